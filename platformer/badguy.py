@@ -1,8 +1,10 @@
-from sprite import Sprite
+from sprite import EntitySprite
 import pygame
 import sys
 
-class BadGuy(Sprite):
+class BadGuy(EntitySprite):
+	__slots__ = ('gid', 'count', 'walk')
+
 	def __init__(self, world, obj):
 		if obj.gid is None:
 			print >>sys.stderr, 'BadGuy: must be created from tile object'
@@ -12,7 +14,7 @@ class BadGuy(Sprite):
 		self.gid = obj.gid
 		tile = world.data.tiles[self.gid]
 
-		Sprite.__init__(self,
+		EntitySprite.__init__(self,
                 world,
                 obj.kind,
                 '{} ({},{})'.format(obj.kind, obj.x, obj.y),
@@ -24,7 +26,14 @@ class BadGuy(Sprite):
                 self.count = 0
                 self.walk = False
 
-        def paint(self, surface):
+        def getState(self):
+                return (EntitySprite.getState(self), self.count, self.walk)
+
+        def setState(self, state):
+                (base, self.count, self.walk) = state
+                EntitySprite.setState(self, base)
+
+        def getTile(self):
                 gid = self.gid
                 if self.dx == 0:
                         gid = 5478
@@ -38,7 +47,7 @@ class BadGuy(Sprite):
                 else:
                         gid = self.gid + 1
 
-                self.paintTile(surface, self.world.data.tiles[gid])
+                return self.world.data.tiles[gid]
 
         def game_logic(self, keys, newkeys): 
             self.addForce('baddieleft', (-1.0, 0.0), 'onetime')  
@@ -0,0 +1,327 @@
+#
+# Benchmarks for the game engine.  Run from this directory:
+#
+#   python benchmark.py [--frames N] [--crowds N ...] [--output results.json]
+#
+# Every map (map.tmx, simplemap.tmx and maps generated from map.tmx with
+# 10, 100 and 1000 bad guys and coins) is loaded and then played with a
+# few scripted key sequences in headless mode.  The results are written as
+# JSON so that runs from different commits can be compared:
+#
+#   * load times for parsing the TMX file, loading the compiled map and
+#     building the whole game
+#   * percentiles of the time spent per frame in World.game_logic,
+#     World.paint and the whole frame
+#   * how many collision queries (World.castSprite and
+#     World.findContacts) were made
+#   * World.paint with the chunk cache against the old per-tile path
+#   * roughly how many objects each frame of game logic allocates
+#
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+
+# keep pygame's greeting out of the JSON on stdout
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+import pygame
+import mapfile
+import world
+from main import Platformer
+
+clock = timeit.default_timer
+
+MAPS = ['map.tmx', 'simplemap.tmx']
+CROWDS = [10, 100, 1000]
+SCRIPTS = ['idle', 'run', 'patrol', 'random']
+
+def summarize(times):
+    # frame times in milliseconds
+    times = sorted(t * 1000.0 for t in times)
+    def percentile(p):
+        return times[min(len(times) * p / 100, len(times) - 1)]
+    return {
+        'mean': sum(times) / len(times),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': times[-1],
+    }
+
+def script(name, frames, seed=0):
+    # a list of (keys, newkeys) for each frame
+    rng = random.Random(seed)
+    keys = set()
+    frames_keys = []
+    for i in range(frames):
+        old = set(keys)
+        if name == 'run':
+            # run right, jumping every so often
+            keys = set([pygame.K_RIGHT])
+            if i % 40 == 0:
+                keys.add(pygame.K_UP)
+        elif name == 'patrol':
+            # run back and forth, firing now and then
+            keys = set([pygame.K_RIGHT if i % 180 < 90 else pygame.K_LEFT])
+            if i % 45 == 0:
+                keys.add(pygame.K_SPACE)
+            if i % 60 == 30:
+                keys.add(pygame.K_UP)
+        elif name == 'random':
+            for k in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN, pygame.K_SPACE):
+                if rng.random() < 0.1:
+                    keys.symmetric_difference_update([k])
+        frames_keys.append((keys, keys - old))
+    return frames_keys
+
+def generateMap(source, crowd, directory, seed=0):
+    # write a copy of source with crowd bad guys and crowd coins scattered
+    # over the open spaces of the map, and return its filename
+    data = mapfile.MapFile(source)
+    gids = {}
+    for o in data.objects:
+        gids.setdefault(o.kind, o.gid)
+
+    # Each object goes on a different open tile, with nothing on it already:
+    # sprites are named after their kind and position, so two on the same
+    # tile would be one sprite.
+    rng = random.Random(seed)
+    solid = data.solid.toArray()
+    (height, width) = solid.shape
+    taken = set((o.x, o.y) for o in data.objects)
+    free = [(x, y) for y in xrange(height) for x in xrange(width)
+            if not solid[y][x] and (x * data.tilewidth, y * data.tileheight) not in taken]
+    if len(free) < 2 * crowd:
+        raise ValueError('{} has room for {} objects, not {}'.format(source, len(free), 2 * crowd))
+    tiles = rng.sample(free, 2 * crowd)
+    objects = []
+    for (n, kind) in enumerate(('badguy', 'coin')):
+        for (x, y) in tiles[n * crowd:(n + 1) * crowd]:
+            objects.append(' <object type="{}" gid="{}" x="{}" y="{}" width="{}" height="{}"/>'.format(
+                kind, gids[kind],
+                x * data.tilewidth, (y + 1) * data.tileheight,
+                data.tilewidth, data.tileheight))
+
+    # put them in an object group of their own
+    with open(source) as f:
+        text = f.read()
+    group = ' <objectgroup name="crowd">\n{}\n </objectgroup>\n</map>'.format('\n'.join(objects))
+    text = re.sub(r'</map>\s*$', group, text)
+
+    filename = os.path.join(directory, '{}-{}.tmx'.format(os.path.splitext(os.path.basename(source))[0], crowd))
+    with open(filename, 'w') as f:
+        f.write(text)
+    return filename
+
+def countCalls(counts, name, method):
+    def counted(*args):
+        counts[name] += 1
+        return method(*args)
+    return counted
+
+def timeCalls(times, method):
+    def timed(*args):
+        start = clock()
+        result = method(*args)
+        times.append(clock() - start)
+        return result
+    return timed
+
+def timeLoad(map_filename):
+    results = {}
+
+    # parse the TMX file from scratch, then load its compiled version
+    mapfile.forgetImages()
+    start = clock()
+    mapfile.MapFile(map_filename, usecache=False)
+    results['tmx'] = (clock() - start) * 1000.0
+    mapfile.MapFile(map_filename)
+    mapfile.forgetImages()
+    start = clock()
+    mapfile.MapFile(map_filename)
+    results['compiled'] = (clock() - start) * 1000.0
+
+    # again, with its tileset images already decoded and converted (as they
+    # are when the next level is loaded)
+    start = clock()
+    mapfile.MapFile(map_filename)
+    results['reload'] = (clock() - start) * 1000.0
+
+    # the whole game, up to the first frame
+    mapfile.forgetImages()
+    start = clock()
+    g = Platformer('benchmark', [map_filename], 480, 480, 30, headless=True)
+    results['game'] = (clock() - start) * 1000.0
+    g.next.wait()
+    return results
+
+def play(map_filename, keys):
+    g = Platformer('benchmark', [map_filename], 480, 480, 30, headless=True)
+    g.next.wait()
+    g.render = True
+    w = g.world
+
+    # every object but the magic (which makes the fireballs) is a sprite
+    objects = len([o for o in g.level.data.objects if o.kind != 'magic'])
+    assert len(w.sprites) == objects, \
+            '{}: {} objects but {} sprites'.format(map_filename, objects, len(w.sprites))
+
+    # instrument this world only
+    counts = {'castSprite': 0, 'findContacts': 0}
+    w.castSprite = countCalls(counts, 'castSprite', w.castSprite)
+    w.findContacts = countCalls(counts, 'findContacts', w.findContacts)
+    logic = []
+    paint = []
+    w.game_logic = timeCalls(logic, w.game_logic)
+    w.paint = timeCalls(paint, w.paint)
+
+    frames = []
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for (k, newk) in keys:
+            start = clock()
+            g.step(k, newk)
+            frames.append(clock() - start)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    queries = dict(counts)
+    queries['per_frame'] = float(sum(counts.values())) / len(keys)
+    return {
+        'frames': len(keys),
+        'sprites': len(w.sprites),
+        'frame': summarize(frames),
+        'world.game_logic': summarize(logic),
+        'world.paint': summarize(paint),
+        'collision_queries': queries,
+    }
+
+def countAllocations(map_filename, keys, warmup=60):
+    # A rough count of the objects allocated by each frame of game logic
+    # once things have settled down.  There is no tracemalloc in Python 2,
+    # so this watches the garbage collector's count of tracked objects
+    # (lists, dicts, tuples, instances and so on, but not numbers or
+    # strings) after every line that runs and adds up how far it goes up.
+    # Objects that come and go within a single line are missed.
+    g = Platformer('benchmark', [map_filename], 480, 480, 30, headless=True)
+    g.next.wait()
+    total = [0, 0]
+    def tracer(frame, event, arg):
+        count = gc.get_count()[0]
+        if count > total[1]:
+            total[0] += count - total[1]
+        total[1] = count
+        return tracer
+
+    allocations = []
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    gc.disable()
+    try:
+        for (i, (k, newk)) in enumerate(keys):
+            if i < warmup:
+                g.step(k, newk)
+                continue
+            total[:] = [0, gc.get_count()[0]]
+            sys.settrace(tracer)
+            g.step(k, newk)
+            sys.settrace(None)
+            allocations.append(total[0])
+    finally:
+        sys.settrace(None)
+        gc.enable()
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    allocations.sort()
+    return {
+        'frames': len(allocations),
+        'mean': float(sum(allocations)) / len(allocations),
+        'p50': allocations[len(allocations) / 2],
+        'max': allocations[-1],
+    }
+
+def comparePaint(map_filename, frames):
+    # World.paint drawing the static layers from the chunk cache and one
+    # tile at a time, scrolling right along the bottom of the map and
+    # bobbing up and down like a player running and jumping
+    data = mapfile.MapFile(map_filename)
+    surface = pygame.display.get_surface()
+    (width, height) = surface.get_size()
+    bottom = data.height * data.tileheight - height
+
+    results = {}
+    for (label, usechunks) in (('per-tile', False), ('chunked', True)):
+        w = world.World(data)
+        w.usechunks = usechunks
+        times = []
+        for i in range(frames):
+            w.x = (i * 4) % (data.width * data.tilewidth - width)
+            w.y = bottom - abs(i % 60 - 30) * 4
+            start = clock()
+            w.paint(surface)
+            times.append(clock() - start)
+        results[label] = summarize(times)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game engine.')
+    parser.add_argument('--frames', type=int, default=600,
+            help='frames to play for each script (default 600)')
+    parser.add_argument('--crowds', type=int, nargs='*', default=CROWDS,
+            help='sizes of the generated maps (default 10 100 1000)')
+    parser.add_argument('--seed', type=int, default=0,
+            help='seed for generated maps and random input')
+    parser.add_argument('--output',
+            help='write the JSON results here instead of to stdout')
+    args = parser.parse_args()
+
+    # tileset images are converted to the display's pixel format as they
+    # are loaded, so the load times are only real with a display to match
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.display.set_mode((480, 480), 0, 32)
+
+    directory = tempfile.mkdtemp(prefix='benchmark')
+    try:
+        maps = list(MAPS)
+        for crowd in args.crowds:
+            maps.append(generateMap('map.tmx', crowd, directory, args.seed))
+
+        results = {
+            'python': sys.version.split()[0],
+            'pygame': pygame.version.ver,
+            'frames': args.frames,
+            'seed': args.seed,
+            'maps': {},
+        }
+        for map_filename in maps:
+            name = os.path.basename(map_filename)
+            print >>sys.stderr, 'benchmarking {}'.format(name)
+            entry = {'load': timeLoad(map_filename), 'scripts': {}}
+            for scriptname in SCRIPTS:
+                keys = script(scriptname, args.frames, args.seed)
+                entry['scripts'][scriptname] = play(map_filename, keys)
+            entry['paint'] = comparePaint(map_filename, args.frames)
+            entry['allocations'] = countAllocations(map_filename,
+                    script('patrol', min(args.frames, 300), args.seed))
+            results['maps'][name] = entry
+    finally:
+        shutil.rmtree(directory)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import collections
+import pygame
+
+class ChunkCache:
+    # pre-rendered copies of a static tile layer, chopped into square chunks
+    # of chunksize x chunksize tiles.  Chunks are drawn the first time they
+    # come into view and the least recently used ones are thrown away once
+    # there are more than maxchunks of them.
+    def __init__(self, data, layer, fill=None, chunksize=8, maxchunks=24):
+        self.data = data
+        self.layer = layer
+        self.fill = fill
+        self.chunksize = chunksize
+        self.maxchunks = maxchunks
+        self.chunks = collections.OrderedDict()
+
+        # size of a chunk in pixels and of the whole layer in chunks
+        self.chunkwidth = chunksize * data.tilewidth
+        self.chunkheight = chunksize * data.tileheight
+        self.sizex = (data.width + chunksize - 1) / chunksize
+        self.sizey = (data.height + chunksize - 1) / chunksize
+
+    def getChunk(self, cx, cy):
+        key = (cx, cy)
+        if key in self.chunks:
+            # mark this chunk as the most recently used one
+            chunk = self.chunks.pop(key)
+        else:
+            chunk = self._buildChunk(cx, cy)
+
+            # forget about the chunk we have not seen for the longest time
+            while len(self.chunks) >= self.maxchunks:
+                self.chunks.popitem(last=False)
+        self.chunks[key] = chunk
+        return chunk
+
+    def _buildChunk(self, cx, cy):
+        (tilesizex, tilesizey) = (self.data.tilewidth, self.data.tileheight)
+
+        # range of tiles covered by this chunk (chunks on the edge may be short)
+        (left, top) = (cx * self.chunksize, cy * self.chunksize)
+        right = min(left + self.chunksize, self.data.width)
+        bottom = min(top + self.chunksize, self.data.height)
+
+        # empty chunks do not need a surface at all
+        block = self.layer[top:bottom, left:right]
+        if self.fill is None and not block.any():
+            return None
+
+        size = ((right - left) * tilesizex, (bottom - top) * tilesizey)
+        if self.fill is None:
+            # transparent chunk to lay over the sprites
+            chunk = pygame.Surface(size, pygame.SRCALPHA, 32)
+            chunk.fill((0, 0, 0, 0))
+        else:
+            # opaque chunk in the same format as the screen
+            chunk = pygame.Surface(size)
+            chunk.fill(self.fill)
+        if pygame.display.get_surface() is not None:
+            if self.fill is None:
+                chunk = chunk.convert_alpha()
+            else:
+                chunk = chunk.convert()
+
+        for (y, row) in enumerate(block):
+            for (x, gid) in enumerate(row):
+                if gid > 0:
+                    chunk.blit(self.data.tiles[gid], (x * tilesizex, y * tilesizey))
+
+        return chunk
+
+    def prepare(self, x, y, width, height):
+        # draw the chunks a view of width x height pixels from (x, y) will
+        # need, ahead of painting it
+        (x, y) = (int(x), int(y))
+        for cy in range(max(y // self.chunkheight, 0),
+                min((y + height - 1) // self.chunkheight, self.sizey - 1) + 1):
+            for cx in range(max(x // self.chunkwidth, 0),
+                    min((x + width - 1) // self.chunkwidth, self.sizex - 1) + 1):
+                self.getChunk(cx, cy)
+
+    def paint(self, surface, x, y):
+        # draw the layer as seen from (x, y) and return the number of blits;
+        # only the part of the surface inside its clip rectangle is drawn
+
+        # which chunks overlap the view?
+        (x, y) = (int(x), int(y))
+        clip = surface.get_clip()
+        left = max((x + clip.left) // self.chunkwidth, 0)
+        top = max((y + clip.top) // self.chunkheight, 0)
+        right = min((x + clip.right - 1) // self.chunkwidth, self.sizex - 1)
+        bottom = min((y + clip.bottom - 1) // self.chunkheight, self.sizey - 1)
+
+        blits = 0
+        for cy in range(top, bottom + 1):
+            for cx in range(left, right + 1):
+                chunk = self.getChunk(cx, cy)
+                if chunk is not None:
+                    surface.blit(chunk,
+                            (cx * self.chunkwidth - x,
+                             cy * self.chunkheight - y))
+                    blits += 1
+        return blits
@@ -0,0 +1,363 @@
+#
+# Streamed map files.
+#
+# For maps too big to keep in memory, a map can be compiled (map.tmx ->
+# map.tmxs) into square chunks of CHUNKSIZE x CHUNKSIZE tiles.  Each chunk
+# is a fixed-size record of its background and foreground gids, its part
+# of the solid map (see SolidMap) and the free runs from each of its tiles,
+# so any chunk can be read on its own.  The objects in each chunk are kept
+# as JSON, found through a table of (offset, length) per chunk, and a JSON
+# table at the end has the tilesets, the first object of each kind and
+# how many there are of each.
+#
+# A ChunkedMap reads chunks as they are asked for and only keeps the most
+# recently used ones, so how much of the map is in memory does not depend
+# on how big it is.
+#
+import collections
+import json
+import mapcache
+import numpy
+import os
+import solidmap
+import struct
+import sys
+
+MAGIC = 'TMXS'
+VERSION = 2
+
+# tiles on a side of a chunk (a multiple of 8, for the solid bits)
+CHUNKSIZE = 32
+
+# chunks a ChunkedMap keeps in memory
+MAXCHUNKS = 64
+
+# magic, version, flags, TMX mtime, TMX size, TMX sha1,
+# width, height, tilewidth, tileheight, chunksize,
+# offsets of the chunk records and of the object directory,
+# offset and length of the JSON table
+HEADER = struct.Struct('<4sHHdQ20sIIIIIQQQQ')
+HAS_FOREGROUND = 0x1
+
+# where a chunk's objects are: offset and length
+DIRECTORY = struct.Struct('<QI')
+
+def cacheFilename(filename):
+    return filename + 's'
+
+def _recordSize(chunksize, flags):
+    # background, foreground, solid bits and four runs per tile
+    tiles = chunksize * chunksize
+    size = tiles * 4 + tiles / 8 + tiles * 4
+    if flags & HAS_FOREGROUND:
+        size += tiles * 4
+    return size
+
+class Chunk:
+    def __init__(self, background, foreground, bits, runs):
+        self.background = background
+        self.foreground = foreground
+        self.bits = bits
+        self.runs = runs
+
+class ChunkedMap:
+    # the parts of a MapFile (see mapcache.CompiledMap) that come from a
+    # streamed map file, with the layers and solid map read a chunk at a time
+    def __init__(self, f, header, table, maxchunks=MAXCHUNKS):
+        self.file = f
+        (flags, self.width, self.height, self.tilewidth, self.tileheight,
+                self.chunksize, self.recordoffset, self.directoryoffset) = header
+        self.recordsize = _recordSize(self.chunksize, flags)
+        self.sizex = (self.width + self.chunksize - 1) / self.chunksize
+        self.sizey = (self.height + self.chunksize - 1) / self.chunksize
+
+        self.backgroundcolor = mapcache.plainString(table['backgroundcolor'])
+        self.tilesets = [(firstgid, mapcache.plainString(source), width, height)
+                for (firstgid, source, width, height) in table['tilesets']]
+        self.usedgids = table['usedgids']
+        self.counts = table['counts']
+        self.firsts = {}
+        for o in table['firsts']:
+            o = tuple(mapcache.plainString(value) for value in o)
+            self.firsts[o[2]] = o
+
+        # the objects are handed out a chunk at a time (see readObjects)
+        self.objects = []
+
+        self.background = ChunkedLayer(self, 'background')
+        if flags & HAS_FOREGROUND:
+            self.foreground = ChunkedLayer(self, 'foreground')
+        else:
+            self.foreground = []
+        self.solid = ChunkedSolidMap(self)
+
+        # the chunks in memory, least recently used first, and the last
+        # one asked for, which is usually the next one asked for too
+        self.maxchunks = maxchunks
+        self.chunks = collections.OrderedDict()
+        self.lastkey = None
+        self.last = None
+
+    def getChunk(self, cx, cy):
+        key = cy * self.sizex + cx
+        if key == self.lastkey:
+            return self.last
+        chunk = self.chunks.pop(key, None)
+        if chunk is None:
+            chunk = self._readChunk(key)
+
+            # forget about the chunk we have not used for the longest time
+            while len(self.chunks) >= self.maxchunks:
+                self.chunks.popitem(last=False)
+        self.chunks[key] = chunk
+        (self.lastkey, self.last) = (key, chunk)
+        return chunk
+
+    def _readChunk(self, key):
+        self.file.seek(self.recordoffset + key * self.recordsize)
+        data = self.file.read(self.recordsize)
+        size = self.chunksize
+        tiles = size * size
+
+        # the pieces are laid out one after the other (see write)
+        background = numpy.frombuffer(data, dtype='<u4', count=tiles).reshape(size, size)
+        offset = tiles * 4
+        foreground = None
+        if isinstance(self.foreground, ChunkedLayer):
+            foreground = numpy.frombuffer(data, dtype='<u4', count=tiles,
+                    offset=offset).reshape(size, size)
+            offset += tiles * 4
+        bits = numpy.frombuffer(data, dtype=numpy.uint8, count=tiles / 8,
+                offset=offset).reshape(size, size / 8)
+        offset += tiles / 8
+        runs = []
+        for direction in (solidmap.LEFT, solidmap.RIGHT, solidmap.UP, solidmap.DOWN):
+            runs.append(numpy.frombuffer(data, dtype=numpy.uint8, count=tiles,
+                    offset=offset).reshape(size, size))
+            offset += tiles
+        return Chunk(background, foreground, bits, runs)
+
+    def readObjects(self, cx, cy):
+        # the objects whose top-left corner is in a chunk, as tuples of
+        # (group, name, kind, x, y, width, height, gid)
+        self.file.seek(self.directoryoffset + (cy * self.sizex + cx) * DIRECTORY.size)
+        (offset, length) = DIRECTORY.unpack(self.file.read(DIRECTORY.size))
+        if length == 0:
+            return []
+        self.file.seek(offset)
+        return [tuple(mapcache.plainString(value) for value in o)
+                for o in json.loads(self.file.read(length))]
+
+class ChunkedLayer:
+    # one tile layer of a ChunkedMap, which can be indexed [y, x] or sliced
+    # [top:bottom, left:right] like the NumPy array it stands in for
+    def __init__(self, chunks, name):
+        self.chunks = chunks
+        self.name = name
+
+    def __len__(self):
+        return self.chunks.height
+
+    def __getitem__(self, key):
+        (y, x) = key
+        if isinstance(y, slice):
+            return self._block(y, x)
+        size = self.chunks.chunksize
+        chunk = self.chunks.getChunk(x // size, y // size)
+        return getattr(chunk, self.name).item(y % size, x % size)
+
+    def _block(self, rows, columns):
+        # copy a rectangle of gids out of the chunks it covers
+        (top, bottom, step) = rows.indices(self.chunks.height)
+        (left, right, step) = columns.indices(self.chunks.width)
+        block = numpy.zeros((max(bottom - top, 0), max(right - left, 0)), dtype=numpy.uint32)
+        if bottom <= top or right <= left:
+            return block
+
+        size = self.chunks.chunksize
+        for cy in xrange(top // size, (bottom - 1) // size + 1):
+            for cx in xrange(left // size, (right - 1) // size + 1):
+                layer = getattr(self.chunks.getChunk(cx, cy), self.name)
+                (x, y) = (cx * size, cy * size)
+                (t, b) = (max(top, y), min(bottom, y + size))
+                (l, r) = (max(left, x), min(right, x + size))
+                block[t - top:b - top, l - left:r - left] = layer[t - y:b - y, l - x:r - x]
+        return block
+
+class ChunkedSolidMap:
+    # the solid map of a ChunkedMap, with the same isSolid and freeRun as a
+    # SolidMap
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.width = chunks.width
+        self.height = chunks.height
+
+    def isSolid(self, x, y):
+        size = self.chunks.chunksize
+        chunk = self.chunks.getChunk(x // size, y // size)
+        (x, y) = (x % size, y % size)
+        return (chunk.bits.item(y, x >> 3) >> (7 - (x & 7))) & 1 == 1
+
+    def freeRun(self, x, y, direction):
+        # see SolidMap.freeRun; a long run may carry on into the next chunk
+        size = self.chunks.chunksize
+        (stepx, stepy) = solidmap.STEPS[direction]
+        total = 0
+        while True:
+            chunk = self.chunks.getChunk(x // size, y // size)
+            run = chunk.runs[direction].item(y % size, x % size)
+            total += run
+            if run < solidmap.MAXRUN:
+                return total
+            (x, y) = (x + stepx * run, y + stepy * run)
+
+def read(filename, maxchunks=MAXCHUNKS):
+    # returns a ChunkedMap for filename, or None if there is no usable one
+    cachename = cacheFilename(filename)
+    try:
+        stat = os.stat(filename)
+        f = open(cachename, 'rb')
+    except (IOError, OSError):
+        return None
+
+    chunks = _read(f, filename, stat, maxchunks)
+    if chunks is None:
+        f.close()
+    return chunks
+
+def _read(f, filename, stat, maxchunks):
+    # the ChunkedMap in filename's open streamed map file, or None
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return None
+    (magic, version, flags, mtime, size, sha1,
+            width, height, tilewidth, tileheight, chunksize,
+            recordoffset, directoryoffset,
+            tableoffset, tablelength) = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    if chunksize == 0 or chunksize % 8 != 0:
+        return None
+
+    # are the chunk records and the object directory inside the file?
+    filesize = os.fstat(f.fileno()).st_size
+    count = ((width + chunksize - 1) / chunksize) * ((height + chunksize - 1) / chunksize)
+    if recordoffset + count * _recordSize(chunksize, flags) > filesize:
+        return None
+    if directoryoffset + count * DIRECTORY.size > filesize:
+        return None
+    if tableoffset + tablelength > filesize:
+        return None
+
+    # has the TMX file changed since it was compiled?
+    if mtime != stat.st_mtime or size != stat.st_size:
+        if size != stat.st_size or sha1 != mapcache.digest(filename):
+            return None
+        mapcache.touch(cacheFilename(filename), stat.st_mtime)
+
+    f.seek(tableoffset)
+    table = f.read(tablelength)
+    if len(table) < tablelength:
+        return None
+    try:
+        return ChunkedMap(f, (flags, width, height, tilewidth, tileheight,
+                chunksize, recordoffset, directoryoffset), json.loads(table), maxchunks)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def _padded(layer, sizex, sizey, chunksize, dtype):
+    # a layer grown to a whole number of chunks
+    padded = numpy.zeros((sizey * chunksize, sizex * chunksize), dtype=dtype)
+    (height, width) = numpy.shape(layer)
+    padded[:height, :width] = layer
+    return padded
+
+def write(mapfile, chunksize=None):
+    # compile a fully loaded MapFile next to its TMX file
+    if chunksize is None:
+        chunksize = CHUNKSIZE
+    filename = mapfile.filename
+    cachename = cacheFilename(filename)
+    (width, height) = (mapfile.width, mapfile.height)
+    sizex = (width + chunksize - 1) / chunksize
+    sizey = (height + chunksize - 1) / chunksize
+
+    # the arrays each chunk record is cut from
+    flags = 0
+    layers = [_padded(mapfile.background, sizex, sizey, chunksize, '<u4')]
+    if len(mapfile.foreground) > 0:
+        layers.append(_padded(mapfile.foreground, sizex, sizey, chunksize, '<u4'))
+        flags |= HAS_FOREGROUND
+    solid = _padded(mapfile.solid.toArray(), sizex, sizey, chunksize, numpy.bool_)
+    runs = [_padded(runs, sizex, sizey, chunksize, numpy.uint8) for runs in mapfile.solid.runs]
+
+    # which chunk each object starts in, the first of each kind and how
+    # many of each there are
+    objects = collections.defaultdict(list)
+    firsts = collections.OrderedDict()
+    counts = collections.defaultdict(int)
+    (chunkwidth, chunkheight) = (chunksize * mapfile.tilewidth, chunksize * mapfile.tileheight)
+    for o in mapfile.objects:
+        cx = min(max(o.x // chunkwidth, 0), sizex - 1)
+        cy = min(max(o.y // chunkheight, 0), sizey - 1)
+        o = (o.group, o.name, o.kind, o.x, o.y, o.width, o.height, o.gid)
+        objects[cy * sizex + cx].append(o)
+        firsts.setdefault(o[2], o)
+        counts[o[2]] += 1
+
+    table = json.dumps({
+        'backgroundcolor': mapfile.backgroundcolor,
+        'tilesets': mapfile.tilesets,
+        'usedgids': mapfile.usedGids(),
+        'firsts': firsts.values(),
+        'counts': counts,
+    })
+
+    # write to a temporary file so a half-written map is never picked up
+    tempname = cachename + '.tmp'
+    try:
+        with open(tempname, 'wb') as f:
+            f.write('\0' * HEADER.size)
+
+            # the chunk records, row by row
+            recordoffset = f.tell()
+            for cy in xrange(sizey):
+                for cx in xrange(sizex):
+                    (top, left) = (cy * chunksize, cx * chunksize)
+                    rows = slice(top, top + chunksize)
+                    columns = slice(left, left + chunksize)
+                    for layer in layers:
+                        f.write(layer[rows, columns].tostring())
+                    f.write(numpy.packbits(solid[rows, columns], axis=1).tostring())
+                    for direction in runs:
+                        f.write(direction[rows, columns].tostring())
+
+            # then the objects, and where to find each chunk's
+            directory = []
+            for key in xrange(sizex * sizey):
+                if key in objects:
+                    text = json.dumps(objects[key])
+                    directory.append((f.tell(), len(text)))
+                    f.write(text)
+                else:
+                    directory.append((0, 0))
+            directoryoffset = f.tell()
+            for (offset, length) in directory:
+                f.write(DIRECTORY.pack(offset, length))
+
+            tableoffset = f.tell()
+            f.write(table)
+
+            stat = os.stat(filename)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, flags,
+                    stat.st_mtime, stat.st_size, mapcache.digest(filename),
+                    width, height, mapfile.tilewidth, mapfile.tileheight, chunksize,
+                    recordoffset, directoryoffset, tableoffset, len(table)))
+        if os.path.exists(cachename):
+            os.remove(cachename)
+        os.rename(tempname, cachename)
+    except (IOError, OSError) as e:
+        print >>sys.stderr, 'chunkfile: could not write {}: {}'.format(cachename, e)
+        if os.path.exists(tempname):
+            os.remove(tempname)
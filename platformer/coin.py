@@ -1,7 +1,9 @@
-from sprite import Sprite
+from sprite import EntitySprite
 import sys
 
-class Coin(Sprite):
+class Coin(EntitySprite):
+    __slots__ = ('gid', 'count', 'spin', 'changed')
+
     def __init__(self, world, obj):
         if obj.gid is None:
             print >>sys.stderr, 'Coin: must be created from tile object'
@@ -10,7 +12,7 @@ class Coin(Sprite):
         self.gid = obj.gid
         tile = world.data.tiles[self.gid]
 
-        Sprite.__init__(self,
+        EntitySprite.__init__(self,
                 world,
                 obj.kind,
                 '{} ({},{})'.format(obj.kind, obj.x, obj.y),
@@ -21,7 +23,14 @@ class Coin(Sprite):
         self.spin = 0
         self.changed = False
 
-    def paint(self, surface):
+    def getState(self):
+        return (EntitySprite.getState(self), self.count, self.spin, self.changed)
+
+    def setState(self, state):
+        (base, self.count, self.spin, self.changed) = state
+        EntitySprite.setState(self, base)
+
+    def getTile(self):
         if self.spin == 0:
             gid = self.gid
         elif self.spin == 15:
@@ -30,7 +39,7 @@ class Coin(Sprite):
             gid = self.gid + 24
         else:
             gid = self.gid + 36
-        self.paintTile(surface, self.world.data.tiles[gid])
+        return self.world.data.tiles[gid]
 
     def game_logic(self, keys, newkeys):
         self.count += 15
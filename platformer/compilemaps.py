@@ -0,0 +1,125 @@
+#
+# Checks and compiles every map in a directory.  Run from this directory
+# (tileset images are found relative to it, as they are by the game):
+#
+#   python compilemaps.py [directory] [--jobs N] [--check] [--stream] [--json]
+#
+# Each TMX file is parsed from scratch with the same rules MapFile uses
+# when the game loads it, and its tiles and objects are checked against
+# what the game knows about.  Maps that pass are compiled (map.tmx ->
+# map.tmxc, and map.tmxs with --stream), so the game does not have to
+# parse them again.  The maps are shared out between a pool of processes,
+# one per core unless --jobs says otherwise.
+#
+# Each map is reported as ok or with a list of problems, each one saying
+# where it was found (the MapFile method, or 'objects' or 'tiles') and what
+# it is.  Problems that would stop the map loading are errors; the rest
+# are warnings.  The exit status is 1 if any map has an error.
+#
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import timeit
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+import chunkfile
+import level
+import mapcache
+import mapfile
+
+clock = timeit.default_timer
+
+def findMaps(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+            if name.endswith('.tmx'))
+
+def checkMap(job):
+    # (in a worker process) check and maybe compile one map; returns a
+    # dict, as exceptions do not travel well between processes
+    (filename, write, stream) = job
+    result = {'map': filename, 'errors': [], 'warnings': []}
+    start = clock()
+    try:
+        data = mapfile.MapFile(filename, usecache=False)
+    except mapfile.MapError as e:
+        result['errors'].append({'where': e.where, 'problem': e.problem})
+    except Exception as e:
+        result['errors'].append({'where': 'MapFile', 'problem': repr(e)})
+    else:
+        _checkContents(data, result)
+        if write and len(result['errors']) == 0:
+            mapcache.write(data)
+            if stream:
+                chunkfile.write(data)
+        result['size'] = [data.width, data.height]
+        result['objects'] = len(data.objects)
+    result['seconds'] = clock() - start
+    return result
+
+def _checkContents(data, result):
+    # what MapFile lets through but the game would trip over later
+    missing = [gid for gid in data.usedGids() if gid not in data.tiles]
+    if len(missing) > 0:
+        result['errors'].append({'where': 'tiles',
+            'problem': 'no tile for gids {}'.format(missing)})
+
+    players = data.countObjects('player')
+    if players != 1:
+        result['errors'].append({'where': 'objects',
+            'problem': 'found {} player objects, expected 1'.format(players)})
+    if data.countObjects('coin') == 0:
+        result['warnings'].append({'where': 'objects',
+            'problem': 'no coins, so the level can never be finished'})
+    for kind in sorted(set(o.kind for o in data.objects) - set(level.KINDS)):
+        result['warnings'].append({'where': 'objects',
+            'problem': 'unknown object type {}'.format(kind)})
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and compile maps.')
+    parser.add_argument('directory', nargs='?', default='.',
+            help='where to look for TMX files (default .)')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+            help='processes to use (default one per core)')
+    parser.add_argument('--check', action='store_true',
+            help='only check the maps, do not compile them')
+    parser.add_argument('--stream', action='store_true',
+            help='compile the chunked files for streaming too')
+    parser.add_argument('--json', action='store_true',
+            help='print the results as JSON')
+    args = parser.parse_args()
+
+    maps = findMaps(args.directory)
+    jobs = [(filename, not args.check, args.stream) for filename in maps]
+    start = clock()
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        try:
+            results = pool.map(checkMap, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [checkMap(job) for job in jobs]
+    elapsed = clock() - start
+
+    failed = [r for r in results if len(r['errors']) > 0]
+    if args.json:
+        print json.dumps({'maps': results, 'failed': len(failed), 'seconds': elapsed},
+                indent=2, sort_keys=True)
+    else:
+        for r in results:
+            status = 'FAILED' if len(r['errors']) > 0 else 'ok'
+            print '{}: {} ({:.0f} ms)'.format(r['map'], status, r['seconds'] * 1000.0)
+            for (label, problems) in (('error', r['errors']), ('warning', r['warnings'])):
+                for p in problems:
+                    print '    {}: {}: {}'.format(label, p['where'], p['problem'])
+        print '{} maps, {} failed, in {:.1f} s with {} processes'.format(
+                len(results), len(failed), elapsed, min(args.jobs, max(len(jobs), 1)))
+
+    if len(failed) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
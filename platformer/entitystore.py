@@ -0,0 +1,128 @@
+import array
+import math
+import numpy
+
+# below this many entities, integrate works through them one at a time, as
+# that is quicker than setting up the numpy calls
+BATCH = 16
+
+# what is kept for each entity
+FIELDS = ('maxdx', 'maxdy', 'constantx', 'constanty',
+          'slowdownx', 'slowdowny', 'onetimex', 'onetimey')
+
+class EntityStore:
+    # Speed limits and forces of simple sprites, one slot each in a numpy
+    # array per field, so that the forces on all of them can be applied at
+    # once (see integrate).  The constant and slowdown forces are the sums
+    # of those on each sprite; onetime forces pile up until the next
+    # integrate.
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.free = []
+        for name in FIELDS:
+            setattr(self, name, numpy.zeros(capacity))
+        self._makeBuffers(capacity)
+
+    def _makeBuffers(self, capacity):
+        # where World.integrate puts the slots and velocities of the
+        # entities to integrate and finds their new velocities, so that
+        # nothing is allocated each frame.  They are arrays Python can
+        # index cheaply, with numpy views onto the same memory (the views
+        # must go whenever the arrays do, so they are never resized).
+        self.slots = array.array('l', [0]) * capacity
+        self.dx = array.array('d', [0.0]) * capacity
+        self.dy = array.array('d', [0.0]) * capacity
+        self._slots = numpy.frombuffer(self.slots, dtype=numpy.int_)
+        self._dx = numpy.frombuffer(self.dx)
+        self._dy = numpy.frombuffer(self.dy)
+        self._work = [numpy.zeros(capacity) for n in xrange(3)]
+
+    def allocate(self):
+        if len(self.free) > 0:
+            slot = self.free.pop()
+        else:
+            slot = self.size
+            self.size += 1
+            if slot == len(self.maxdx):
+                self._grow()
+        for name in FIELDS:
+            getattr(self, name)[slot] = 0.0
+        return slot
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def _grow(self):
+        # double the room for entities; slots stay where they are
+        for name in FIELDS:
+            old = getattr(self, name)
+            new = numpy.zeros(len(old) * 2)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self._makeBuffers(len(self.maxdx))
+
+    def getState(self):
+        # a copy of every entity, for World.getState
+        return (self.size, list(self.free),
+                [getattr(self, name)[:self.size].copy() for name in FIELDS])
+
+    def setState(self, state):
+        (self.size, free, arrays) = state
+        self.free = list(free)
+        for (name, array) in zip(FIELDS, arrays):
+            getattr(self, name)[:len(array)] = array
+
+    def integrate(self, count):
+        # apply the forces on the first count entities in slots to their
+        # velocities in dx and dy and clip them to their maximum speed, like
+        # Sprite.move does one at a time; the new velocities replace the
+        # old ones
+        if count < BATCH:
+            self._integrateEach(count)
+            return
+        slots = self._slots[:count]
+        self._integrateAxis(slots, self._dx[:count], self.constantx,
+                self.onetimex, self.slowdownx, self.maxdx)
+        self._integrateAxis(slots, self._dy[:count], self.constanty,
+                self.onetimey, self.slowdowny, self.maxdy)
+
+    def _integrateAxis(self, slots, velocity, constant, onetime, slowdown, maximum):
+        # one axis of integrate, worked out in place in the scratch arrays
+        # (every slot is in range, so take need not check them)
+        (new, force, limit) = [work[:len(slots)] for work in self._work]
+        constant.take(slots, out=force, mode='clip')
+        numpy.add(velocity, force, out=new)
+        onetime.take(slots, out=force, mode='clip')
+        numpy.add(new, force, out=new)
+        onetime[slots] = 0.0
+
+        # slowdown forces push against the direction we were going
+        numpy.abs(new, out=force)
+        slowdown.take(slots, out=limit, mode='clip')
+        numpy.minimum(force, limit, out=force)
+        numpy.copysign(force, velocity, out=force)
+        numpy.subtract(new, force, out=new)
+
+        maximum.take(slots, out=limit, mode='clip')
+        numpy.negative(limit, out=force)
+        numpy.maximum(new, force, out=new)
+        numpy.minimum(new, limit, out=velocity)
+
+    def _integrateEach(self, count):
+        # the same, one entity at a time
+        (slots, dx, dy) = (self.slots, self.dx, self.dy)
+        (constantx, constanty) = (self.constantx, self.constanty)
+        (onetimex, onetimey) = (self.onetimex, self.onetimey)
+        (slowdownx, slowdowny) = (self.slowdownx, self.slowdowny)
+        (maxdx, maxdy) = (self.maxdx, self.maxdy)
+        for n in xrange(count):
+            (slot, olddx, olddy) = (slots[n], dx[n], dy[n])
+            x = olddx + constantx.item(slot) + onetimex.item(slot)
+            y = olddy + constanty.item(slot) + onetimey.item(slot)
+            onetimex[slot] = 0.0
+            onetimey[slot] = 0.0
+            x -= math.copysign(min(abs(x), slowdownx.item(slot)), olddx)
+            y -= math.copysign(min(abs(y), slowdowny.item(slot)), olddy)
+            (limitx, limity) = (maxdx.item(slot), maxdy.item(slot))
+            dx[n] = min(max(x, -limitx), limitx)
+            dy[n] = min(max(y, -limity), limity)
@@ -1,16 +1,40 @@
 #
 # You should not need to edit this file.
 #
+import os
+import profiler
 import pygame
 import pygame.locals
 
+# the most ticks of game logic run before painting the screen again; if
+# the game logic cannot keep up even then, the game slows down
+MAXTICKS = 8
+
 class Game:
-    def __init__(self, name, width, height, frames_per_second):
+    # The game logic runs at a fixed frames_per_second, and the screen is
+    # painted render_fps times a second (as often as the game logic unless
+    # it says otherwise).  Each paint runs however many ticks of game logic
+    # are due first, so if painting falls behind the screen is painted less
+    # often, but the game logic still gets all of its ticks.
+    def __init__(self, name, width, height, frames_per_second, headless=False, render_fps=None):
         self.width = width
         self.height = height
         self.frames_per_second = frames_per_second
+        if render_fps is None:
+            render_fps = frames_per_second
+        self.render_fps = render_fps
         self.on = True
 
+        # headless games have no window or sound and run as fast as they can;
+        # they only paint if render is turned back on
+        self.headless = headless
+        self.render = not headless
+        self.frames = 0
+        self.profiler = profiler.Profiler()
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
         self.screen = pygame.display.set_mode(
                 # set the size
                 (width, height),
@@ -19,7 +43,10 @@ class Game:
                 pygame.locals.DOUBLEBUF |
 
                 # apply alpha blending
-                pygame.locals.SRCALPHA)
+                pygame.locals.SRCALPHA,
+
+                # the dummy driver would otherwise give us 8-bit color
+                32 if headless else 0)
 
         # set the title of the window
         pygame.display.set_caption(name)
@@ -27,21 +54,71 @@ class Game:
     def game_logic(self, keys, newkeys, buttons, newbuttons, mouse_position, dt):
         raise NotImplementedError()
 
-    def paint(self, surface):
+    # paint the screen and return the list of rectangles that changed, or
+    # None if the whole screen needs updating.  alpha is how far it is from
+    # the last tick of game logic to the next, for games that want to draw
+    # things partway between where they were and where they are now.
+    def paint(self, surface, alpha=1.0):
         raise NotImplementedError()
 
-    def main_loop(self):
+    def step(self, keys, newkeys, buttons=frozenset(), newbuttons=frozenset(), mouse_position=(1,1)):
+        # run a single frame with the given input, without waiting for the
+        # clock; the game is told a whole frame's worth of time has passed
+        dt = 1. / self.frames_per_second
+        self.profiler.beginFrame()
+        self._tick(keys, newkeys, buttons, newbuttons, mouse_position, dt)
+        self._show(1.0)
+        self.profiler.endFrame()
+
+    def _tick(self, keys, newkeys, buttons, newbuttons, mouse_position, dt):
+        if self.on:
+            self.profiler.start('game_logic')
+            self.game_logic(keys, newkeys, buttons, newbuttons, mouse_position, dt)
+            self.profiler.stop('game_logic')
+        self.frames += 1
+
+    def _show(self, alpha):
+        rects = None
+        if self.on and self.render:
+            self.profiler.start('paint')
+            rects = self.paint(self.screen, alpha)
+            self.profiler.stop('paint')
+
+        if not self.headless:
+            self.profiler.start('flip')
+            if rects is None:
+                pygame.display.flip()
+            else:
+                # only copy the parts of the screen that changed
+                pygame.display.update(rects)
+            self.profiler.stop('flip')
+
+    def main_loop(self, frames=None):
         clock = pygame.time.Clock()
         keys = set()
         buttons = set()
         mouse_position = (1,1)
 
-        while True:
-            clock.tick(self.frames_per_second)
-            dt = clock.get_time() / 1000. # convert to seconds
-
-            newkeys = set()
-            newbuttons = set()
+        # keys and buttons pressed since the last tick, which might have
+        # been more than one paint ago
+        newkeys = set()
+        newbuttons = set()
+
+        # time that has passed and not been simulated yet
+        dt = 1. / self.frames_per_second
+        behind = 0.0
+
+        while frames is None or self.frames < frames:
+            if self.headless:
+                # no need to keep to real time: one tick, painted as is
+                clock.tick()
+                behind = dt
+            else:
+                clock.tick(self.render_fps)
+                behind = min(behind + clock.get_time() / 1000., MAXTICKS * dt)
+
+            self.profiler.beginFrame()
+            self.profiler.start('events')
             for e in pygame.event.get():
                 # did the user try to close the window?
                 if e.type == pygame.QUIT:
@@ -72,10 +149,19 @@ class Game:
                     newkeys.add(e.key)
                 if e.type == pygame.KEYUP:
                     keys.discard(e.key)
-
-            if self.on:
-                self.game_logic(keys, newkeys, buttons, newbuttons, mouse_position, dt)
-                self.paint(self.screen)
-
-            pygame.display.flip()
+            self.profiler.stop('events')
+
+            # as many ticks as are due, then paint where things have got to
+            while behind >= dt and (frames is None or self.frames < frames):
+                self._tick(keys, newkeys, buttons, newbuttons, mouse_position, dt)
+                newkeys = set()
+                newbuttons = set()
+                behind -= dt
+            if self.headless:
+                self._show(1.0)
+            else:
+                self._show(behind / dt)
+            self.profiler.endFrame()
+
+        pygame.quit()
 
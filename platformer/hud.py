@@ -0,0 +1,123 @@
+import pygame
+
+class Hud:
+    # everything drawn over the top of the world, painted in the order added
+    def __init__(self):
+        self.elements = []
+
+    def add(self, element):
+        self.elements.append(element)
+        return element
+
+    def changedRects(self):
+        # the screen rectangles that need painting again because an element
+        # changed since it was last painted (where it was and where it is)
+        rects = []
+        for element in self.elements:
+            if element.changed:
+                if element.painted is not None:
+                    rects.append(element.painted)
+                rects.append(element.get_rect())
+        return rects
+
+    def paint(self, surface, rects=None):
+        # paint every element, or only those overlapping rects
+        blits = 0
+        for element in self.elements:
+            rect = element.get_rect()
+            if rects is None or rect.collidelist(rects) != -1:
+                blits += element.paint(surface)
+                element.painted = rect
+                element.changed = False
+        return blits
+
+class Text:
+    # a piece of text, positioned by its bottom-left corner, that is only
+    # rendered again when it changes
+    def __init__(self, font, color, x, y, text=''):
+        self.font = font
+        self.color = color
+        self.x = x
+        self.y = y
+        self.text = None
+        self.image = None
+        self.painted = None
+        self.changed = True
+        self.set(text)
+
+    def set(self, text):
+        if text != self.text:
+            self.text = text
+            self.image = self.font.render(text, False, self.color)
+            self.changed = True
+
+    def get_width(self):
+        return self.image.get_width()
+
+    def get_rect(self):
+        (width, height) = self.image.get_size()
+        return pygame.Rect(self.x, self.y - height, width, height)
+
+    def paint(self, surface):
+        surface.blit(self.image, (self.x, self.y - self.image.get_height()))
+        return 1
+
+class DigitAtlas:
+    # the glyphs for 0-9 and '-' rendered once, side by side on one surface,
+    # for numbers that change too often to render with the font each time
+    GLYPHS = '0123456789-'
+
+    def __init__(self, font, color):
+        glyphs = [font.render(c, False, color) for c in self.GLYPHS]
+        self.height = max(g.get_height() for g in glyphs)
+        self.image = pygame.Surface((sum(g.get_width() for g in glyphs), self.height),
+                pygame.SRCALPHA, 32)
+        self.image.fill((0, 0, 0, 0))
+
+        # remember where each glyph ended up
+        self.rects = {}
+        x = 0
+        for (c, glyph) in zip(self.GLYPHS, glyphs):
+            self.image.blit(glyph, (x, 0))
+            self.rects[c] = pygame.Rect(x, 0, glyph.get_width(), self.height)
+            x += glyph.get_width()
+
+    def width(self, digits):
+        return sum(self.rects[c].width for c in digits)
+
+    def paint(self, surface, digits, x, y):
+        # draw a string of digits with its top-left corner at (x, y)
+        for c in digits:
+            rect = self.rects[c]
+            surface.blit(self.image, (x, y), rect)
+            x += rect.width
+        return len(digits)
+
+class Number:
+    # a whole number drawn from a DigitAtlas, positioned by its bottom-left
+    # corner
+    def __init__(self, atlas, x, y, value=0):
+        self.atlas = atlas
+        self.x = x
+        self.y = y
+        self.value = None
+        self.digits = ''
+        self.painted = None
+        self.changed = True
+        self.set(value)
+
+    def set(self, value):
+        if value != self.value:
+            self.value = value
+            self.digits = str(value)
+            self.changed = True
+
+    def get_width(self):
+        return self.atlas.width(self.digits)
+
+    def get_rect(self):
+        height = self.atlas.height
+        return pygame.Rect(self.x, self.y - height, self.get_width(), height)
+
+    def paint(self, surface):
+        return self.atlas.paint(surface, self.digits, self.x, self.y - self.atlas.height)
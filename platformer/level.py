@@ -0,0 +1,85 @@
+from badguy import BadGuy
+from coin import Coin
+from magic import MagicPool
+from player import Player
+import world
+
+# the kinds of object a map can have (see addObject)
+KINDS = ('player', 'coin', 'badguy', 'magic')
+
+class Level:
+    # A map ready to play: the world made from it, with its sprites in it,
+    # and the ones the game needs to keep hold of.  Everything here can be
+    # done on a loading thread, so the next level can be made while this
+    # one is played.
+    def __init__(self, data, width, height, profiler=None):
+        self.data = data
+        self.world = world.World(data, profiler=profiler)
+        self.world.setView(width, height)
+        self.width = width
+        self.height = height
+
+        self.player = None
+        self.magic = None
+
+        # the level is finished once all of its coins have been picked up
+        self.coins = data.countObjects('coin')
+
+        if data.chunks is not None:
+            # a streamed map only has the player and the magic to start
+            # with; the world asks for the rest as they come near
+            for kind in ('player', 'magic'):
+                elt = data.findObject(kind)
+                if elt is not None:
+                    self.addObject(elt)
+            self.world.spawn = self.addObject
+            self.world.streamChunks()
+        else:
+            for elt in data.objects:
+                self.addObject(elt)
+
+        # and what the player will see first
+        self.world.prepare()
+
+    def addObject(self, elt):
+        # is this the player?
+        if elt.kind == 'player':
+            if self.player is not None:
+                return
+            self.player = Player(self.world, elt)
+            self.world.addSprite(self.player)
+
+            # the world revolves around the player
+            self.world.x = self.player.x + self.player.width / 2 - self.width / 2
+            self.world.y = self.player.y + self.player.height / 2 - self.height / 2
+
+        # is this a coin?
+        elif elt.kind == 'coin':
+            self.world.addSprite(Coin(self.world, elt))
+
+        elif elt.kind == 'badguy':
+            self.world.addSprite(BadGuy(self.world, elt))
+
+        # the player's fireballs
+        elif elt.kind == 'magic':
+            if self.magic is None:
+                self.magic = MagicPool(self.world, elt)
+
+        else:
+            print 'Sprite of unknown type {} found'.format(elt.kind)
+
+    def getState(self):
+        # see World.getState
+        magic = None
+        if self.magic is not None:
+            magic = self.magic.getState()
+        return (self.world.getState(), magic)
+
+    def setState(self, state):
+        (world, magic) = state
+        self.world.setState(world)
+        if self.magic is not None:
+            self.magic.setState(magic)
+
+    def finished(self):
+        return self.coins > 0 and self.player.coincount >= self.coins
@@ -0,0 +1,43 @@
+import sys
+import threading
+
+class Loader:
+    # Runs a slow function (loading a map, decoding an image) on a thread
+    # of its own so that the caller can get on with something else.  The
+    # function can tell us how far it has got through report(), for a
+    # progress screen.  If it raises an exception (SystemExit included),
+    # wait() raises it again in the thread that asks for the result.
+    def __init__(self):
+        self.progress = 0.0
+        self.message = 'Loading'
+        self.result = None
+        self.error = None
+        self.thread = None
+
+    def start(self, function, *args, **kwargs):
+        self.thread = threading.Thread(target=self._run, args=(function, args, kwargs))
+        # do not keep the game alive if the window is closed while loading
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def _run(self, function, args, kwargs):
+        try:
+            self.result = function(*args, **kwargs)
+        except BaseException:
+            self.error = sys.exc_info()
+
+    def report(self, progress, message):
+        # called from the loading thread; progress goes from 0.0 to 1.0
+        self.progress = progress
+        self.message = message
+
+    def finished(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def wait(self):
+        self.thread.join()
+        if self.error is not None:
+            (kind, value, traceback) = self.error
+            raise kind, value, traceback
+        return self.result
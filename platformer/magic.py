@@ -1,9 +1,17 @@
-from sprite import Sprite
+from sprite import EntitySprite
 import pygame
 import sys
 
-class Magic(Sprite):
-	def __init__(self, world, obj):
+# how many fireballs a MagicPool has to throw, and how fast they fly
+POOLSIZE = 8
+SPEED = 8.0
+
+class Magic(EntitySprite):
+	__slots__ = ('gid', 'count', 'walk', 'pool')
+
+	# name tells apart the fireballs made from the same object (see
+	# MagicPool), which they go back to when they hit something
+	def __init__(self, world, obj, name=None, pool=None):
 		if obj.gid is None:
 			print >>sys.stderr, 'BadGuy: must be created from tile object'
 			sys.exit(1)
@@ -11,18 +19,20 @@ class Magic(Sprite):
 		self.gid = obj.gid
                 tile = world.data.tiles[self.gid]
 
-		Sprite.__init__(self,
+		if name is None:
+			name = '{} ({},{})'.format(obj.kind, obj.x, obj.y)
+		EntitySprite.__init__(self,
                 world,
                 obj.kind,
-                '{} ({},{})'.format(obj.kind, obj.x, obj.y),
+                name,
                 tile.get_width(), tile.get_height(),
                 obj.x, obj.y,
                 (16.0, 16.0))
-		self.addForce('friction', (1.0, 0.0), 'slowdown')
                 self.count = 0
                 self.walk = False
+                self.pool = pool
 
-        def paint(self, surface):
+        def getTile(self):
                 gid = self.gid
                 if self.dx == 0:
                         gid = 5478
@@ -36,35 +46,89 @@ class Magic(Sprite):
                 else:
                         gid = self.gid + 1
 
-                self.paintTile(surface, self.world.data.tiles[gid])
+                return self.world.data.tiles[gid]
 
         def game_logic(self, keys, newkeys): 
-            self.addForce('magicmove', (2.0, 0.0), 'onetime')  
+            # fly straight on at the speed we were thrown
             self.move()
 
-        def setx(self, x):
-            self.x = x
-
-        def sety(self, y):
-            self.y = y
-
-        def handledirection(self, direction):
+        def launch(self, x, y, direction):
+            # start from (x, y), flying left if direction is 'left' and
+            # right otherwise
+            self.x = float(x)
+            self.y = float(y)
             if direction == 'left':
-                self.d = (-2.0, 0.0)
-            if direction == 'right':
-                self.d = (2.0, 0.0)
-            return self.d 
+                self.dx = -SPEED
+            else:
+                self.dx = SPEED
+            self.dy = 0.0
 
-            
+        def finish(self):
+            if self.pool is not None:
+                self.pool.release(self)
+            else:
+                self.world.removeSprite(self)
 
         def handleCollisionWith(self, name, other):
             if name == 'boundary' or name == 'solid':
-                self.world.removeSprite(self)
+                self.finish()
                 return True
 
             if other.kind == 'badguy':
                 print "dead!"
                 self.world.removeSprite(other)
-                self.world.removeSprite(self)
+                self.finish()
 
             return False
+
+class MagicPool:
+    # A fixed set of fireballs made from one map object.  Throwing one
+    # takes it from the pool and puts it in the world, and it goes back
+    # when it hits something or leaves the view, so throwing never makes
+    # a new sprite and there are never more than size of them in flight.
+    def __init__(self, world, obj, size=POOLSIZE):
+        self.world = world
+        self.free = [Magic(world, obj, '{} {}'.format(obj.kind, n), self)
+                for n in xrange(size)]
+        self.flying = []
+
+    def throw(self, x, y, direction):
+        # returns the fireball thrown, or None if they are all in flight
+        if len(self.free) == 0:
+            return None
+        magic = self.free.pop()
+        magic.launch(x, y, direction)
+        self.flying.append(magic)
+        self.world.addSprite(magic)
+        return magic
+
+    def release(self, magic):
+        if magic not in self.flying:
+            return
+        self.world.removeSprite(magic)
+        self.flying.remove(magic)
+        self.free.append(magic)
+
+    def getState(self):
+        return (list(self.free), list(self.flying))
+
+    def setState(self, state):
+        (free, flying) = state
+        self.free = list(free)
+        self.flying = list(flying)
+
+    def update(self):
+        # once a frame: bring back the fireballs that have left the view,
+        # or that something else took out of the world
+        world = self.world
+        (left, top) = (world.x, world.y)
+        (right, bottom) = (left + (world.viewwidth or 0), top + (world.viewheight or 0))
+        for n in xrange(len(self.flying) - 1, -1, -1):
+            magic = self.flying[n]
+            (x, y) = (magic.x, magic.y)
+            if magic.name not in world.sprites:
+                self.release(magic)
+            elif world.viewwidth is not None and \
+                 (x + magic.width <= left or x >= right or
+                  y + magic.height <= top or y >= bottom):
+                self.release(magic)
@@ -1,50 +1,20 @@
+import argparse
 import game
-import coin
-import player
+import hud
+import level
+import loader
 import mapfile
-import world
 import pygame
-import badguy
-import magic
+import replay
+import sys
+import timeit
 
 class Platformer(game.Game):
-    def __init__(self, name, map_filename, width, height, frames_per_second):
-        game.Game.__init__(self, name, width, height, frames_per_second)
+    def __init__(self, name, maplist, width, height, frames_per_second, headless=False, stream=False,
+            render_fps=None):
+        game.Game.__init__(self, name, width, height, frames_per_second, headless, render_fps)
         pygame.mixer.init()
-        
-
-        # parse the map data
-        data = mapfile.MapFile(map_filename)
-
-        # create the world
-        self.world = world.World(data)
-
-        # create the sprites
-        for elt in data.objects:
-            # is this the player?
-            if elt.kind == 'player':
-                self.p = player.Player(self.world, elt)
-                self.world.addSprite(self.p)
-
-                # the world revolves around the player
-                self.world.x = self.p.x + self.p.width / 2 - width / 2
-                self.world.y = self.p.y + self.p.height / 2 - height / 2
-
-            # is this a coin?
-            elif elt.kind == 'coin':
-                c = coin.Coin(self.world, elt)
-                self.world.addSprite(c)
-
-            elif elt.kind == 'badguy':
-                b = badguy.BadGuy(self.world, elt)
-                self.world.addSprite(b)
-
-            elif elt.kind == "magic":
-                    self.m = magic.Magic(self.world, elt)
-                    
-
-            else:
-                print 'Sprite of unknown type {} found'.format(elt.kind)
+        pygame.init()
 
         #score counter
         self.score_color = (255, 255, 255)
@@ -53,41 +23,196 @@ class Platformer(game.Game):
         self.coincount = 0
         self.font2 = pygame.font.SysFont("Courier New",20)
 
-
-    def draw(self, surface):
+        # the score label never changes, and the number is drawn from
+        # pre-rendered digits
+        self.hud = hud.Hud()
+        label = self.hud.add(hud.Text(self.font2, self.score_color, self.score_x, self.score_y, "Score: "))
+        digits = hud.DigitAtlas(self.font2, self.score_color)
+        self.score = self.hud.add(hud.Number(digits, self.score_x + label.get_width(), self.score_y))
+
+        # frame profiler overlay, toggled with F3, and whether it was on
+        # the screen after the last paint
+        self.profiler_font = pygame.font.SysFont("Courier New",12)
+        self.overlay = False
+
+        # the levels are played in turn.  Each one is loaded in the
+        # background, showing how far it has got until it is ready (headless
+        # games just wait for it), and after that the next is loaded while
+        # it is played.
+        self.maplist = maplist
+        self.stream = stream
+
+        # if set, a replay.Recording that the input to each frame of game
+        # logic is added to
+        self.recording = None
+
+        self.number = 0
+        self.world = None
+        self.loading = self.preload(self.number)
+        if headless:
+            self.enter(self.loading.wait())
+
+    def preload(self, number):
+        # start making level number (going round to the first after the
+        # last) in the background
+        loading = loader.Loader()
+        filename = self.maplist[number % len(self.maplist)]
+        return loading.start(self.prepare, filename, loading.report)
+
+    def prepare(self, filename, progress):
+        # (on the loading thread)
+        data = mapfile.MapFile(filename, progress=progress, stream=self.stream)
+        return level.Level(data, self.width, self.height, self.profiler)
+
+    def enter(self, ready):
+        self.level = ready
+        self.world = ready.world
+        self.p = ready.player
+        self.magic = ready.magic
+
+        # start again from here if the player dies before the next checkpoint
+        self.checkpoint()
+
+        # get the one after this ready while this one is played
+        self.next = self.preload(self.number + 1)
+
+    def checkpoint(self):
+        self.saved = (self.coincount, self.level.getState())
+
+    def restart(self):
+        # back to the last checkpoint
+        (self.coincount, state) = self.saved
+        self.level.setState(state)
+
+    def nextLevel(self):
+        # bank the coins from this level and go on to the next one, which
+        # should be ready by now; if not, show how far it has got
+        self.coincount += self.p.coincount
+        self.number += 1
+        self.loading = self.next
+        self.world = None
+        if self.headless or self.loading.finished():
+            self.enter(self.loading.wait())
+
+    def draw(self, surface, rects=None):
         # rect = pygame.Rect(0,0,self.width,self.height)
         # surface.fill((0,0,0),rect )
-        score_str = "Score: " + str(self.p.coincount)
-        self.drawTextLeft(surface, score_str, self.score_color, self.score_x, self.score_y, self.font2)
-
-    def drawTextLeft(self, surface, text, color, x, y,font):
-        textobj = font.render(text, False, color)
-        textrect = textobj.get_rect()
-        textrect.bottomleft = (x, y)
-        surface.blit(textobj, textrect)
-        return
+        self.profiler.count('blits', self.hud.paint(surface, rects))
+        if self.profiler.enabled:
+            self.profiler.paint(surface, self.profiler_font, self.score_x, self.score_y + 10,
+                    1. / self.render_fps)
 
     def game_logic(self, keys, newkeys, buttons, newbuttons, mouse_position, dt):
-        self.world.game_logic(keys, newkeys)
-        if pygame.K_SPACE in newkeys:
-            if self.p.face == 'right':
-                self.world.addSprite(self.m)
-                self.m.setx(self.p.x)
-                self.m.sety(self.p.y)
-            if self.p.face == 'left':
-                self.world.addSprite(self.m)
-                
+        if pygame.K_F3 in newkeys:
+            self.profiler.toggle()
+
+        # still loading?
+        if self.world is None:
+            if not self.loading.finished():
+                return
+            self.enter(self.loading.wait())
 
+        if self.recording is not None:
+            self.recording.record(keys, newkeys)
+
+        self.world.game_logic(keys, newkeys)
+        if self.magic is not None:
+            if pygame.K_SPACE in newkeys:
+                self.magic.throw(self.p.x, self.p.y, self.p.face)
+            self.magic.update()
+
+        # killed?  Then back to the last checkpoint
+        if self.p.name not in self.world.sprites:
+            self.restart()
+        elif pygame.K_c in newkeys:
+            self.checkpoint()
+
+        self.score.set(self.coincount + self.p.coincount)
+
+        # all the coins picked up?
+        if self.level.finished():
+            self.nextLevel()
+
+
+    def paintLoading(self, surface):
+        # what the map loader is up to, and a bar for how far it has got
+        surface.fill((0, 0, 0))
+        text = self.font2.render(self.loading.message, False, self.score_color)
+        surface.blit(text, ((self.width - text.get_width()) / 2,
+                self.height / 2 - text.get_height() - 8))
+        bar = pygame.Rect(self.width / 4, self.height / 2, self.width / 2, 12)
+        pygame.draw.rect(surface, self.score_color, bar, 1)
+        bar.width = int(bar.width * self.loading.progress)
+        surface.fill(self.score_color, bar)
+
+    def paint(self, surface, alpha=1.0):
+        if self.world is None:
+            self.paintLoading(surface)
+            return None
+
+        # the profiler overlay changes every frame, so paint everything
+        # while it is showing, and once more to get rid of it
+        if self.profiler.enabled or self.overlay:
+            self.world.invalidate()
+        self.overlay = self.profiler.enabled
 
-    def paint(self, surface):
         # self.draw(surface)
-        self.world.paint(surface)
-        self.draw(surface)
+        rects = self.world.paint(surface, self.hud.changedRects(), alpha)
+        self.draw(surface, rects)
+        return rects
        
 
+def playBack(filename):
+    # run a recording as fast as it will go, and check it ends up where it
+    # did when it was recorded
+    recording = replay.read(filename)
+    g = Platformer('Dungeon Trainee!', recording.maplist, 480, 480, recording.fps,
+            True, recording.stream)
+    start = timeit.default_timer()
+    same = replay.play(g, recording)
+    elapsed = timeit.default_timer() - start
+    print '{}: {} frames in {:.2f} s ({:.0f} fps), {}'.format(filename, recording.frames,
+            elapsed, recording.frames / max(elapsed, 1e-6),
+            'same final state' if same else 'DIFFERENT final state')
+    return same
+
 def main():
     maplist = ['map.tmx', 'simplemap.tmx']
-    g = Platformer('Dungeon Trainee!', maplist[0], 480, 480, 30)
-    g.main_loop()
 
-main()
+    parser = argparse.ArgumentParser(description='Dungeon Trainee!')
+    parser.add_argument('--headless', action='store_true',
+            help='run without a window or sound, as fast as possible')
+    parser.add_argument('--frames', type=int,
+            help='stop after this many frames')
+    parser.add_argument('--render-fps', type=int, default=60,
+            help='how often to paint the screen (the game logic runs at 30 frames a second)')
+    parser.add_argument('--stream', action='store_true',
+            help='only keep the part of the map near the player in memory')
+    parser.add_argument('--record', metavar='FILE',
+            help='save the keys pressed to FILE, to be played back with --replay')
+    parser.add_argument('--replay', metavar='FILE',
+            help='play back a recording headless and check where it ends up')
+    args = parser.parse_args()
+
+    # a broken map is reported when its level is reached (see compilemaps.py
+    # to check them all first)
+    try:
+        if args.replay is not None:
+            if not playBack(args.replay):
+                sys.exit(1)
+            return
+
+        g = Platformer('Dungeon Trainee!', maplist, 480, 480, 30, args.headless, args.stream,
+                args.render_fps)
+        if args.record is not None:
+            g.recording = replay.Recording(maplist, g.frames_per_second, args.stream)
+        g.main_loop(args.frames)
+        if g.recording is not None:
+            g.recording.digest = replay.digest(g)
+            replay.write(args.record, g.recording)
+    except (mapfile.MapError, replay.ReplayError) as e:
+        print >>sys.stderr, e
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#
+# Compiled map files.
+#
+# Parsing a TMX file means walking the XML and base64-decoding and
+# inflating every layer.  The first time a map is loaded we write the
+# result next to it (map.tmx -> map.tmxc) as a fixed header, the raw layer
+# arrays and a JSON table of tilesets, objects and the gids the map uses.
+# Later loads memory-map that file and hand out NumPy arrays that point straight into it.
+#
+# A compiled file is used as long as the TMX file it came from has the
+# same modification time and size, or failing that the same SHA-1 hash (in
+# which case the new modification time is written into it, so the next
+# load doesn't hash the file again).  Anything wrong with a compiled file,
+# such as it being cut short, just means it isn't used.
+#
+import hashlib
+import json
+import mmap
+import numpy
+import os
+import solidmap
+import struct
+import sys
+
+MAGIC = 'TMXC'
+VERSION = 2
+
+# magic, version, flags, TMX mtime, TMX size, TMX sha1,
+# width, height, tilewidth, tileheight,
+# offsets of the background and foreground layers and of the solid map
+# (see SolidMap.tostring),
+# offset and length of the JSON table
+HEADER = struct.Struct('<4sHHdQ20sIIIIQQQQQ')
+HAS_FOREGROUND = 0x1
+
+# the TMX mtime on its own, and where it is in the header (the streamed
+# files made by chunkfile keep it in the same place)
+MTIME = struct.Struct('<d')
+MTIMEOFFSET = struct.calcsize('<4sHH')
+
+def cacheFilename(filename):
+    return filename + 'c'
+
+def digest(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+def _align(offset):
+    # keep the layer arrays on 8-byte boundaries
+    return (offset + 7) & ~7
+
+def touch(cachename, mtime):
+    # record a new TMX mtime in a compiled file whose contents still match
+    try:
+        with open(cachename, 'r+b') as f:
+            f.seek(MTIMEOFFSET)
+            f.write(MTIME.pack(mtime))
+    except (IOError, OSError):
+        pass
+
+def plainString(value):
+    # JSON gives back unicode, but the XML parser gives plain strings for
+    # anything that is ASCII
+    if isinstance(value, unicode):
+        try:
+            return value.encode('ascii')
+        except UnicodeError:
+            pass
+    return value
+
+class CompiledMap:
+    def __init__(self, header, table, background, foreground, solid):
+        (self.width, self.height, self.tilewidth, self.tileheight) = header
+        self.backgroundcolor = plainString(table['backgroundcolor'])
+        self.tilesets = [(firstgid, plainString(source), width, height)
+                for (firstgid, source, width, height) in table['tilesets']]
+        self.objects = [tuple(plainString(value) for value in o) for o in table['objects']]
+        self.usedgids = table['usedgids']
+        self.background = background
+        self.foreground = foreground
+        self.solid = solid
+
+def read(filename):
+    # returns a CompiledMap for filename, or None if there is no usable one
+    cachename = cacheFilename(filename)
+    try:
+        stat = os.stat(filename)
+        f = open(cachename, 'rb')
+    except (IOError, OSError):
+        return None
+
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError):
+        return None
+    finally:
+        f.close()
+
+    if len(data) < HEADER.size:
+        return None
+    (magic, version, flags, mtime, size, sha1,
+            width, height, tilewidth, tileheight,
+            bgoffset, fgoffset, solidoffset,
+            tableoffset, tablelength) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    if tableoffset + tablelength > len(data):
+        return None
+
+    # is every layer inside the file?
+    count = width * height
+    layers = [(bgoffset, 4 * count), (solidoffset, solidmap.stringLength(width, height))]
+    if flags & HAS_FOREGROUND:
+        layers.append((fgoffset, 4 * count))
+    for (offset, length) in layers:
+        if offset + length > len(data):
+            return None
+
+    # has the TMX file changed since it was compiled?
+    if mtime != stat.st_mtime or size != stat.st_size:
+        if size != stat.st_size or sha1 != digest(filename):
+            return None
+        touch(cachename, stat.st_mtime)
+
+    try:
+        table = json.loads(data[tableoffset:tableoffset + tablelength])
+    except ValueError:
+        return None
+
+    # the layers are views onto the mapped file, not copies of it
+    background = numpy.frombuffer(data, dtype='<u4', count=count, offset=bgoffset)
+    background = background.reshape(height, width)
+    if flags & HAS_FOREGROUND:
+        foreground = numpy.frombuffer(data, dtype='<u4', count=count, offset=fgoffset)
+        foreground = foreground.reshape(height, width)
+    else:
+        foreground = []
+    solid = solidmap.frombuffer(data, solidoffset, width, height)
+    return CompiledMap((width, height, tilewidth, tileheight),
+            table, background, foreground, solid)
+
+def write(mapfile):
+    # compile a freshly parsed MapFile next to its TMX file
+    filename = mapfile.filename
+    cachename = cacheFilename(filename)
+    (width, height) = (mapfile.width, mapfile.height)
+
+    table = json.dumps({
+        'backgroundcolor': mapfile.backgroundcolor,
+        'tilesets': mapfile.tilesets,
+        'usedgids': mapfile.usedGids(),
+        'objects': [(o.group, o.name, o.kind, o.x, o.y, o.width, o.height, o.gid)
+            for o in mapfile.objects],
+    })
+
+    # lay the pieces out one after the other
+    layers = [numpy.asarray(mapfile.background, dtype='<u4')]
+    flags = 0
+    if len(mapfile.foreground) > 0:
+        layers.append(numpy.asarray(mapfile.foreground, dtype='<u4'))
+        flags |= HAS_FOREGROUND
+    layers.append(numpy.frombuffer(mapfile.solid.tostring(), dtype=numpy.uint8))
+
+    offsets = []
+    offset = _align(HEADER.size)
+    for layer in layers:
+        offsets.append(offset)
+        offset = _align(offset + layer.nbytes)
+    if not flags & HAS_FOREGROUND:
+        offsets.insert(1, 0)
+
+    stat = os.stat(filename)
+    header = HEADER.pack(MAGIC, VERSION, flags,
+            stat.st_mtime, stat.st_size, digest(filename),
+            width, height, mapfile.tilewidth, mapfile.tileheight,
+            offsets[0], offsets[1], offsets[2],
+            offset, len(table))
+
+    # write to a temporary file so a half-written cache is never picked up
+    tempname = cachename + '.tmp'
+    try:
+        with open(tempname, 'wb') as f:
+            f.write(header)
+            for (start, layer) in zip([o for o in offsets if o != 0], layers):
+                f.write('\0' * (start - f.tell()))
+                f.write(layer.tostring())
+            f.write('\0' * (offset - f.tell()))
+            f.write(table)
+        if os.path.exists(cachename):
+            os.remove(cachename)
+        os.rename(tempname, cachename)
+    except (IOError, OSError) as e:
+        print >>sys.stderr, 'mapcache: could not write {}: {}'.format(cachename, e)
+        if os.path.exists(tempname):
+            os.remove(tempname)
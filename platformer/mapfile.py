@@ -1,25 +1,102 @@
 import xml.etree.ElementTree
 import base64
 import zlib
+import chunkfile
+import loader
+import mapcache
+import numpy
 import pygame
-import sys
+import solidmap
+
+# Tiled stores flip/rotation flags in the top bits of each gid
+FLIPPED_HORIZONTALLY_FLAG = 0x80000000
+FLIPPED_VERTICALLY_FLAG = 0x40000000
+FLIPPED_DIAGONALLY_FLAG = 0x20000000
+GID_MASK = 0x1FFFFFFF
+
+# tileset images by filename, as Loaders that decode them (see _loadImage),
+# and the decoded images converted to the display's pixel format (see
+# Tiles._convertImage)
+_decoders = {}
+_converted = {}
+
+class MapError(Exception):
+    # what is wrong with a map file, and where in MapFile it was found
+    def __init__(self, filename, where, problem):
+        Exception.__init__(self, '{}: {}: {}'.format(filename, where, problem))
+        self.filename = filename
+        self.where = where
+        self.problem = problem
+
+def forgetImages():
+    # decode the tileset images again the next time they are used
+    _decoders.clear()
+    _converted.clear()
 
 class MapFile:
-    def __init__(self, filename):
+    # progress, if given, is called as progress(fraction, message) as the
+    # map loads (see Loader.report).  A map that is streamed only has the
+    # chunks of it that are in use in memory (see chunkfile); its objects
+    # come from chunkObjects rather than objects.
+    def __init__(self, filename, usecache=True, progress=None, stream=False):
         self.filename = filename
-
+        self.tilesets = []
+        self.usedgids = None
+        self.progress = progress
+        self.chunks = None
+
+        # tileset images being decoded in the background (see _loadImage)
+        self.decoding = []
+
+        # use the compiled version of the map if it is still up to date
+        compiled = None
+        if stream:
+            self._report(0.0, 'Loading {}'.format(filename))
+            compiled = chunkfile.read(filename)
+            if compiled is None:
+                # compiling it is the one time the whole map is in memory
+                chunkfile.write(MapFile(filename, usecache=False))
+                compiled = chunkfile.read(filename)
+            if compiled is None:
+                raise MapError(self.filename, 'MapFile', 'could not stream {}'.format(filename))
+            self.chunks = compiled
+        elif usecache:
+            self._report(0.0, 'Loading {}'.format(filename))
+            compiled = mapcache.read(filename)
+        if compiled is not None:
+            self._loadCompiled(compiled)
+        else:
+            try:
+                self._loadTMX(filename)
+            except (KeyError, ValueError) as e:
+                raise MapError(filename, 'MapFile', 'missing or bad attribute: {}'.format(e))
+            if usecache:
+                mapcache.write(self)
+
+        # cut out the tiles we know we will need; the rest wait until used
+        self._report(0.8, 'Preparing tiles')
+        self.tiles.preload(self.usedGids())
+        self._report(1.0, 'Done')
+
+    def _report(self, fraction, message):
+        if self.progress is not None:
+            self.progress(fraction, message)
+
+    def _loadTMX(self, filename):
         # load and parse the TMX file
-        tree = xml.etree.ElementTree.parse(filename)
+        self._report(0.0, 'Reading {}'.format(filename))
+        try:
+            tree = xml.etree.ElementTree.parse(filename)
+        except (IOError, xml.etree.ElementTree.ParseError) as e:
+            raise MapError(filename, 'MapFile', str(e))
         element = tree.getroot()
 
         # gather basic attributes of the entire map
         if element.tag != 'map':
-            print >>sys.stderr, 'MapFile: root element of TMX file must be a "map"'
-            sys.exit(1)
+            raise MapError(self.filename, 'MapFile', 'root element of TMX file must be a "map"')
         attr = element.attrib
         if attr['orientation'] != 'orthogonal':
-            print >>sys.stderr, 'MapFile: map must have "orthogonal" orientation'
-            sys.exit(1)
+            raise MapError(self.filename, 'MapFile', 'map must have "orthogonal" orientation')
         self.tilewidth = int(attr['tilewidth'])
         self.tileheight = int(attr['tileheight'])
         self.width = int(attr['width'])
@@ -30,13 +107,16 @@ class MapFile:
             self.backgroundcolor = '#000000'
 
         # now parse the pieces
-        self.tiles = {}
+        self.tiles = Tiles(self.tilewidth, self.tileheight)
         self.background = []
         self.foreground = []
-        self.solid = []
+        self.solid = None
         self.objects = []
 
-        for child in element:
+        children = list(element)
+        for (n, child) in enumerate(children):
+            self._report(0.1 + 0.4 * n / len(children), 'Reading {}'.format(filename))
+
             # load a tileset
             if child.tag == 'tileset':
                 self._loadTileset(child)
@@ -46,33 +126,24 @@ class MapFile:
                 # load a background layer
                 if child.attrib['name'] == 'background':
                     if len(self.background) > 0:
-                        print >>sys.stderr, 'MapFile: >1 background layers found'
-                        sys.exit(1)
+                        raise MapError(self.filename, 'MapFile', '>1 background layers found')
                     self.background = self._loadLayer(child, 'background')
 
                 #Load Foreground layer
                 elif child.attrib['name'] == 'foreground':
                     if len(self.foreground) > 0:
-                        print >>sys.stderr, 'MapFile: >1 foreground layers found'
-                        sys.exit(1)
+                        raise MapError(self.filename, 'MapFile', '>1 foreground layers found')
                     self.foreground = self._loadLayer(child, 'foreground')
 
                 # load a solid layer
                 elif child.attrib['name'] == 'solid':
-                    if len(self.solid) > 0:
-                        print >>sys.stderr, 'MapFile: >1 solid layers found'
-                        sys.exit(1)
-                    layer = self._loadLayer(child, 'solid')
-                    for row in layer:
-                        srow = []
-                        for elt in row:
-                            srow.append(elt > 0)
-                        self.solid.append(srow)
+                    if self.solid is not None:
+                        raise MapError(self.filename, 'MapFile', '>1 solid layers found')
+                    self.solid = solidmap.fromArray(self._loadLayer(child, 'solid') > 0)
 
                 # no other known layer types
                 else:
-                    print >>sys.stderr, 'MapFile: unknown layer found in map file: {}'.format(child.attrib['name'])
-                    sys.exit(1)
+                    raise MapError(self.filename, 'MapFile', 'unknown layer found in map file: {}'.format(child.attrib['name']))
 
             # load object data
             elif child.tag == 'objectgroup':
@@ -80,44 +151,92 @@ class MapFile:
 
             # some other element we don't know how to process
             else:
-                print >>sys.stderr, 'MapFile: unknown child element: {}'.format(child.tag)
-                sys.exit(1)
+                raise MapError(self.filename, 'MapFile', 'unknown child element: {}'.format(child.tag))
+
+        # wait for the tileset images
+        self._finishImages()
 
         # make sure we found everything we expected
         if len(self.background) == 0:
-            print >>sys.stderr, 'MapFile: no background layer found'
-            sys.exit(1)
-        if len(self.solid) == 0:
-            print >>sys.stderr, 'MapFile: no solid layer found'
-            sys.exit(1)
+            raise MapError(self.filename, 'MapFile', 'no background layer found')
+        if self.solid is None:
+            raise MapError(self.filename, 'MapFile', 'no solid layer found')
         if len(self.tiles) == 0:
-            print >>sys.stderr, 'MapFile: no tileset found'
-            sys.exit(1)
+            raise MapError(self.filename, 'MapFile', 'no tileset found')
+
+    def _loadCompiled(self, compiled):
+        self.tilewidth = compiled.tilewidth
+        self.tileheight = compiled.tileheight
+        self.width = compiled.width
+        self.height = compiled.height
+        self.backgroundcolor = compiled.backgroundcolor
+
+        # the layers come straight out of the compiled file
+        self.tiles = Tiles(self.tilewidth, self.tileheight)
+        for (gid, source, imagewidth, imageheight) in compiled.tilesets:
+            self._loadImage(source, gid, imagewidth, imageheight)
+        self._finishImages()
+        self.background = compiled.background
+        self.foreground = compiled.foreground
+        self.solid = compiled.solid
+        self.objects = [Object(*o) for o in compiled.objects]
+        self.usedgids = compiled.usedgids
+
+    def chunkObjects(self, cx, cy):
+        # the objects that start in one chunk of a streamed map
+        return [Object(*o) for o in self.chunks.readObjects(cx, cy)]
+
+    def findObject(self, kind):
+        # the first object of a kind, or None; for a streamed map this does
+        # not need its chunk to be loaded
+        if self.chunks is not None:
+            o = self.chunks.firsts.get(kind)
+            if o is None:
+                return None
+            return Object(*o)
+        for o in self.objects:
+            if o.kind == kind:
+                return o
+        return None
+
+    def countObjects(self, kind):
+        if self.chunks is not None:
+            return self.chunks.counts.get(kind, 0)
+        return len([o for o in self.objects if o.kind == kind])
+
+    def usedGids(self):
+        if self.usedgids is not None:
+            return self.usedgids
+
+        gids = set()
+        for layer in (self.background, self.foreground):
+            if len(layer) > 0:
+                gids.update(numpy.flatnonzero(numpy.bincount(layer.ravel())).tolist())
+        for o in self.objects:
+            if o.gid is not None:
+                gids.add(o.gid)
+        gids.discard(0)
+        self.usedgids = sorted(gids)
+        return self.usedgids
 
     def _loadTileset(self, element):
         if element.tag != 'tileset':
-            print >>sys.stderr, '_loadTileset: wrong root element type: {}'.format(element.tag)
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTileset', 'wrong root element type: {}'.format(element.tag))
         attr = element.attrib
 
         # make sure this is a simple tileset with no complicating factors
         if 'tilewidth' in attr and int(attr['tilewidth']) != self.tilewidth:
-            print >>sys.stderr, '_loadTileset: tile width mismatch: expecting {}, found {}'. \
-                    format(self.tilewidth, int(attr['tilewidth']))
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTileset', 'tile width mismatch: expecting {}, found {}'. \
+                    format(self.tilewidth, int(attr['tilewidth'])))
         if 'tileheight' in attr and int(attr['tileheight']) != self.tileheight:
-            print >>sys.stderr, '_loadTileset: tile height mismatch: expecting {}, found {}'. \
-                    format(self.tileheight, int(attr['tileheight']))
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTileset', 'tile height mismatch: expecting {}, found {}'. \
+                    format(self.tileheight, int(attr['tileheight'])))
         if 'spacing' in attr and int(attr['spacing']) != 0:
-            print >>sys.stderr, '_loadTileset: must have 0 spacing between tiles'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTileset', 'must have 0 spacing between tiles')
         if 'margin' in attr and int(attr['margin']) != 0:
-            print >>sys.stderr, '_loadTileset: must have 0 margin between tiles'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTileset', 'must have 0 margin between tiles')
         if 'source' in attr:
-            print >>sys.stderr, '_loadTileset: tileset must come from image file, not TSX file'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTileset', 'tileset must come from image file, not TSX file')
 
         # where does our numbering start?
         gid = int(attr['firstgid'])
@@ -127,30 +246,24 @@ class MapFile:
         for child in element:
             if child.tag == 'image':
                 if loadedImage:
-                    print >>sys.stderr, '_loadTileset: >1 image file found for a single tileset'
-                    sys.exit(1)
+                    raise MapError(self.filename, '_loadTileset', '>1 image file found for a single tileset')
                 loadedImage = True
                 self._loadTilesetImage(child, gid)
             else:
-                print >>sys.stderr, '_loadTileset: {} objects are not supported in tilesets'.format(child.tag)
-                sys.exit(1)
+                raise MapError(self.filename, '_loadTileset', '{} objects are not supported in tilesets'.format(child.tag))
         if not loadedImage:
-            print >>sys.stderr, '_loadTileset: did not find tileset image'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTileset', 'did not find tileset image')
 
     def _loadTilesetImage(self, element, gid):
         if element.tag != 'image':
-            print >>sys.stderr, '_loadTilesetImage: wrong root element type: {}'.format(element.tag)
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTilesetImage', 'wrong root element type: {}'.format(element.tag))
         attr = element.attrib
 
         # make sure there is nothing complicated about this image
         if 'format' in attr:
-            print >>sys.stderr, '_loadTilesetImage: image file must not be embedded'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTilesetImage', 'image file must not be embedded')
         if 'trans' in attr:
-            print >>sys.stderr, '_loadTilesetImage: transparency colors are not supported: use alpha channel'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadTilesetImage', 'transparency colors are not supported: use alpha channel')
         imagewidth = -1
         if 'width' in attr:
             imagewidth = int(attr['width'])
@@ -158,118 +271,119 @@ class MapFile:
         if 'height' in attr:
             imageheight = int(attr['height'])
         if 'source' not in attr:
-            print >>sys.stderr, '_loadTilesetImage: missing source attribute'
-            sys.exit(1)
-
-        # load the image file
-        image = pygame.image.load(attr['source'])
+            raise MapError(self.filename, '_loadTilesetImage', 'missing source attribute')
+
+        self._loadImage(attr['source'], gid, imagewidth, imageheight)
+
+    def _loadImage(self, source, gid, imagewidth, imageheight):
+        # start decoding the image file; pygame lets go of the interpreter
+        # while it does that, so we can carry on reading the map meanwhile.
+        # Each image is only decoded once, however many maps use it.
+        decoder = _decoders.get(source)
+        if decoder is None:
+            decoder = _decoders[source] = loader.Loader().start(pygame.image.load, source)
+        self.decoding.append((decoder, source, gid, imagewidth, imageheight))
+
+    def _finishImages(self):
+        # add the tileset images to the tiles as they finish decoding
+        for (n, (decoder, source, gid, imagewidth, imageheight)) in enumerate(self.decoding):
+            self._report(0.5 + 0.3 * n / len(self.decoding), 'Decoding {}'.format(source))
+            try:
+                image = decoder.wait()
+            except (IOError, pygame.error) as e:
+                raise MapError(self.filename, '_loadImage', 'could not load {}: {}'.format(source, e))
+            self._addImage(image, source, gid, imagewidth, imageheight)
+        self.decoding = []
+
+    def _addImage(self, image, source, gid, imagewidth, imageheight):
         (sizex, sizey) = image.get_size()
         if imagewidth >= 0 and imagewidth != sizex:
-            print >>sys.stderr, '_loadTilesetImage: image width mismatch: expected {}, found {}'.format(imagewidth, sizex)
-            sys.exit(1)
+            raise MapError(self.filename, '_loadImage', 'image width mismatch: expected {}, found {}'.format(imagewidth, sizex))
         if imageheight >= 0 and imageheight != sizey:
-            print >>sys.stderr, '_loadTilesetImage: image height mismatch: expected {}, found {}'.format(imageheight, sizey)
-            sys.exit(1)
-
-        # carve it up into tiles
-        for y in range(0, imageheight, self.tileheight):
-            for x in range(0, imagewidth, self.tilewidth):
-                r = pygame.rect.Rect(x, y, self.tilewidth, self.tileheight)
-                tile = image.subsurface(r)
-                if gid in self.tiles:
-                    print >>sys.stderr, '_loadTilesetImage: duplicate gid: {}'.format(gid)
-                    sys.exit(1)
-                self.tiles[gid] = tile
-                gid += 1
+            raise MapError(self.filename, '_loadImage', 'image height mismatch: expected {}, found {}'.format(imageheight, sizey))
+
+        # the tiles get carved out of it as they are needed
+        if not self.tiles.addImage(image, gid, source):
+            raise MapError(self.filename, '_loadImage', 'duplicate gid: {}'.format(gid))
+        self.tilesets.append((gid, source, sizex, sizey))
 
     def _loadLayer(self, element, name):
         if element.tag != 'layer':
-            print >>sys.stderr, '_loadTileset: wrong root element type: {}'.format(element.tag)
-            sys.exit(1)
+            raise MapError(self.filename, '_loadLayer', 'wrong root element type: {}'.format(element.tag))
         attr = element.attrib
 
         # check the attributes
         if 'name' not in attr or attr['name'] != name:
-            print >>sys.stderr, '_loadLayer: expected layer with name {}, found {}'.format(repr(name), repr(attr['name']))
-            sys.exit(1)
+            raise MapError(self.filename, '_loadLayer', 'expected layer with name {}, found {}'.format(repr(name), repr(attr['name'])))
         if 'x' in attr and int(attr['x']) != 0:
-            print >>sys.stderr, '_loadLayer: found x != 0'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadLayer', 'found x != 0')
         if 'y' in attr and int(attr['y']) != 0:
-            print >>sys.stderr, '_loadLayer: found y != 0'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadLayer', 'found y != 0')
         if 'width' in attr and int(attr['width']) != self.width:
-            print >>sys.stderr, '_loadLayer: width of {} does not match map width of {}'.format(int(attr['width']), self.width)
-            sys.exit(1)
+            raise MapError(self.filename, '_loadLayer', 'width of {} does not match map width of {}'.format(int(attr['width']), self.width))
         if 'height' in attr and int(attr['height']) != self.height:
-            print >>sys.stderr, '_loadLayer: height of {} does not match map height of {}'.format(int(attr['height']), self.height)
-            sys.exit(1)
+            raise MapError(self.filename, '_loadLayer', 'height of {} does not match map height of {}'.format(int(attr['height']), self.height))
         # ignore opacity and visible attributes
 
         # load the actual data
         loadedData = False
-        data = []
+        data = None
         for child in element:
             if child.tag != 'data':
-                print >>sys.stderr, '_loadLayer: child element of unsupported type {} found'.format(child.tag)
-                sys.exit(1)
+                raise MapError(self.filename, '_loadLayer', 'child element of unsupported type {} found'.format(child.tag))
             if loadedData:
-                print >>sys.stderr, '_loadLayer: >1 data elements found'
-                sys.exit(1)
+                raise MapError(self.filename, '_loadLayer', '>1 data elements found')
 
             # is it in a format we understand?
-            gids = []
-            if 'encoding' not in child.attrib and 'compression' not in child.attrib:
+            encoding = child.attrib.get('encoding')
+            compression = child.attrib.get('compression')
+            if encoding is None and compression is None:
                 # load the list of tile numbers
+                gids = []
                 for tile in child:
                     if tile.tag != 'tile':
-                        print >>sys.stderr, '_loadLayer: expected tile, found {} element'.format(tile.tag)
-                        sys.exit(1)
+                        raise MapError(self.filename, '_loadLayer', 'expected tile, found {} element'.format(tile.tag))
                     gid = int(tile.attrib['gid'])
                     gids.append(gid)
-            elif child.attrib['encoding'] != 'base64':
-                print >>sys.stderr, '_loadLayer: unsupported encoding type: {}'.format(child.attrib['encoding'])
-                sys.exit(1)
-            elif child.attrib['compression'] != 'gzip' and child.attrib['compression'] != 'zlib':
-                print >>sys.stderr, '_loadLayer: unsupported compression type: {}'.format(child.attrib['compression'])
-                sys.exit(1)
+                gids = numpy.array(gids, dtype=numpy.uint32)
+            elif encoding != 'base64':
+                raise MapError(self.filename, '_loadLayer', 'unsupported encoding type: {}'.format(encoding))
+            elif compression not in (None, 'gzip', 'zlib'):
+                raise MapError(self.filename, '_loadLayer', 'unsupported compression type: {}'.format(compression))
             else:
-                comp_elt = base64.standard_b64decode(child.text)
-                if child.attrib['compression'] == 'gzip':
-                    raw = zlib.decompress(comp_elt[10:], -zlib.MAX_WBITS)
-                else:
-                    raw = zlib.decompress(comp_elt)
-                for i in range(0, len(raw), 4):
-                    chunk = raw[i:i+4]
-                    gid =  ord(chunk[0])
-                    gid += ord(chunk[1]) * 0x100
-                    gid += ord(chunk[2]) * 0x10000
-                    gid += ord(chunk[3]) * 0x1000000
-                    gids.append(gid)
-
-            # convert it into rows
-            row = []
-            for (count, gid) in enumerate(gids):
-                row.append(gid)
-                if count % self.width == self.width - 1:
-                    data.append(row)
-                    row = []
-            if len(row) != 0 or len(data) != self.height:
-                print >>sys.stderr, '_loadLayer: found wrong number of tiles: {} when {} expected'.format(count, self.height * self.width)
-                sys.exit(1)
+                try:
+                    raw = base64.standard_b64decode(child.text)
+                    if compression == 'gzip':
+                        raw = zlib.decompress(raw[10:], -zlib.MAX_WBITS)
+                    elif compression == 'zlib':
+                        raw = zlib.decompress(raw)
+                except (TypeError, zlib.error) as e:
+                    raise MapError(self.filename, '_loadLayer', 'could not decode layer data: {}'.format(e))
+                gids = self._decodeLayerData(raw)
+
+            # convert it into a height x width array
+            if len(gids) != self.width * self.height:
+                raise MapError(self.filename, '_loadLayer', 'found wrong number of tiles: {} when {} expected'.format(len(gids), self.height * self.width))
+
+            # we do not support flipped tiles, so just drop the flags
+            data = numpy.bitwise_and(gids, GID_MASK).reshape(self.height, self.width)
 
             loadedData = True
 
         if not loadedData:
-            print >>sys.stderr, '_loadLayer: no data section found'
-            sys.exit(1)
+            raise MapError(self.filename, '_loadLayer', 'no data section found')
 
         return data
 
+    def _decodeLayerData(self, raw):
+        # layer data is a packed array of little-endian 32-bit gids
+        if len(raw) % 4 != 0:
+            raise MapError(self.filename, '_decodeLayerData', 'layer data is not a whole number of tiles')
+        return numpy.frombuffer(raw, dtype='<u4')
+
     def _loadObjectlayer(self, element):
         if element.tag != 'objectgroup':
-            print >>sys.stderr, '_loadObjectlayer: wrong root element type: {}'.format(element.tag)
-            sys.exit(1)
+            raise MapError(self.filename, '_loadObjectlayer', 'wrong root element type: {}'.format(element.tag))
         attr = element.attrib
 
         # ignore color, x, y, width, height, opacity, and visible
@@ -277,8 +391,7 @@ class MapFile:
 
         for child in element:
             if child.tag != 'object':
-                print >>sys.stderr, '_loadObjectlayer: child element must be of type object, not {}'.format(child.tag)
-                sys.exit(1)
+                raise MapError(self.filename, '_loadObjectlayer', 'child element must be of type object, not {}'.format(child.tag))
             attr = child.attrib
 
             # get the name if any
@@ -291,8 +404,7 @@ class MapFile:
             if 'type' in attr and attr['type'] != '':
                 kind = attr['type']
             else:
-                print >>sys.stderr, '_loadObjectlayer: object must have a type'
-                sys.exit(1)
+                raise MapError(self.filename, '_loadObjectlayer', 'object must have a type')
 
             # get the object's position in pixels
             x = int(attr['x'])
@@ -312,8 +424,7 @@ class MapFile:
 
             # make sure there are no child elements
             if len(child) > 0:
-                print >>sys.stderr, '_loadObjectlayer: object must not have properties or be an ellipse, polygon, polyline, or image'
-                sys.exit(1)
+                raise MapError(self.filename, '_loadObjectlayer', 'object must not have properties or be an ellipse, polygon, polyline, or image')
 
             o = Object(groupname, name, kind, x, y, width, height, gid)
             self.objects.append(o)
@@ -324,6 +435,93 @@ class MapFile:
     def __repr__(self):
         return self.__str__()
 
+class Tiles:
+    # gid-indexed table of tile images.  Each tile is a subsurface of its
+    # tileset image, which is converted to the display's pixel format once,
+    # however many maps use it.  Tiles are only cut out the first time they
+    # are asked for.
+    def __init__(self, tilewidth, tileheight):
+        self.tilewidth = tilewidth
+        self.tileheight = tileheight
+        self.images = []
+        self.names = []
+        self.converted = []
+        self.tiles = []
+        self.sources = []
+        self.count = 0
+
+    def addImage(self, image, firstgid, source=None):
+        columns = image.get_width() / self.tilewidth
+        rows = image.get_height() / self.tileheight
+        count = columns * rows
+
+        # make room for the new gids, refusing any that are already taken
+        if len(self.sources) < firstgid + count:
+            extra = firstgid + count - len(self.sources)
+            self.tiles.extend([None] * extra)
+            self.sources.extend([None] * extra)
+        for gid in range(firstgid, firstgid + count):
+            if self.sources[gid] is not None:
+                return False
+
+        index = len(self.images)
+        self.images.append(image)
+        self.names.append(source)
+        self.converted.append(False)
+        for n in range(count):
+            (row, column) = divmod(n, columns)
+            self.sources[firstgid + n] = (index, column * self.tilewidth, row * self.tileheight)
+        self.count += count
+        return True
+
+    def preload(self, gids):
+        for gid in gids:
+            if gid in self:
+                self[gid]
+
+    def _convertImage(self, index):
+        # blits are much faster when the pixel format matches the screen
+        image = self.images[index]
+        if pygame.display.get_surface() is None:
+            return image
+        source = self.names[index]
+        converted = _converted.get(source)
+        if converted is None or converted[0] is not image:
+            if image.get_flags() & pygame.SRCALPHA:
+                converted = (image, image.convert_alpha())
+            else:
+                converted = (image, image.convert())
+            if source is not None:
+                _converted[source] = converted
+        image = self.images[index] = converted[1]
+        self.converted[index] = True
+        return image
+
+    def _makeTile(self, gid):
+        (index, x, y) = self.sources[gid]
+        image = self.images[index]
+        if not self.converted[index]:
+            image = self._convertImage(index)
+        tile = image.subsurface(pygame.rect.Rect(x, y, self.tilewidth, self.tileheight))
+        self.tiles[gid] = tile
+        return tile
+
+    def __getitem__(self, gid):
+        if gid < 0 or gid >= len(self.tiles):
+            raise KeyError(gid)
+        tile = self.tiles[gid]
+        if tile is None:
+            if self.sources[gid] is None:
+                raise KeyError(gid)
+            tile = self._makeTile(gid)
+        return tile
+
+    def __contains__(self, gid):
+        return 0 <= gid < len(self.sources) and self.sources[gid] is not None
+
+    def __len__(self):
+        return self.count
+
 class Object:
     def __init__(self, group, name, kind, x, y, width, height, gid):
         self.group = group
@@ -1,9 +1,12 @@
 from sprite import Sprite
 from magic import *
 import pygame
+import soundbank
 import sys
 
 class Player(Sprite):
+    __slots__ = ('gid', 'count', 'walk', 'coincount', 'face', 'sounds')
+
     def __init__(self, world, obj):
         if obj.gid is None:
             print >>sys.stderr, 'Player: must be created from tile object'
@@ -26,28 +29,39 @@ class Player(Sprite):
         self.walk = False
         self.coincount = 0
         self.face = "word"
-        pygame.init()
-        self.coinsound = pygame.mixer.Sound("coin.wav")
+        self.sounds = soundbank.shared()
+        self.sounds.load("coin.wav")
+
+    def getState(self):
+        return (Sprite.getState(self), self.count, self.walk, self.coincount, self.face)
+
+    def setState(self, state):
+        (base, self.count, self.walk, self.coincount, self.face) = state
+        Sprite.setState(self, base)
 
-    def paint(self, surface):
+    def getTile(self):
         gid = self.gid
         if self.dx == 0:
             gid = 3251-1
         if self.dx < 0:
             gid = self.gid - 172
-            self.face = 'left'
         if self.dx > 0:
             gid = self.gid + 172
-            self.face = 'right'
 
         if self.walk:
             gid = self.gid
         else:
             gid = self.gid + 1
 
-        self.paintTile(surface, self.world.data.tiles[gid])
+        return self.world.data.tiles[gid]
 
     def game_logic(self, keys, newkeys):
+        # face the way we were last moving
+        if self.dx < 0:
+            self.face = 'left'
+        if self.dx > 0:
+            self.face = 'right'
+
         self.count += 1
         if self.count == 10:
             self.count = 0
@@ -89,7 +103,7 @@ class Player(Sprite):
             return True
 
         if other.kind == 'coin':
-            self.coinsound.play()
+            self.sounds.play("coin.wav")
             print 'I got a coin!'
             self.coincount += 1
             print self.coincount
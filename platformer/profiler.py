@@ -0,0 +1,102 @@
+import collections
+import timeit
+import pygame
+
+clock = timeit.default_timer
+
+class Profiler:
+    # Timings and counters for each frame.  Everything is a no-op until the
+    # profiler is enabled, and turning it on or off only takes effect at the
+    # start of the next frame so that no section is left half-timed.
+    #
+    # Sections are timed with start(name)/stop(name), or add(name, seconds)
+    # for time measured elsewhere; counters go up with count(name).
+    def __init__(self, history=120):
+        self.enabled = False
+        self.wanted = False
+        self.starts = {}
+        self.times = {}
+        self.counts = {}
+        self.frameStart = 0.0
+
+        # smoothed times and the last frame's counts, for display
+        self.averages = {}
+        self.lastCounts = {}
+        self.order = []
+        self.history = collections.deque(maxlen=history)
+
+    def toggle(self):
+        self.wanted = not self.wanted
+
+    def beginFrame(self):
+        if self.wanted != self.enabled:
+            self.enabled = self.wanted
+            self.averages.clear()
+            self.history.clear()
+        if not self.enabled:
+            return
+        self.times.clear()
+        self.counts.clear()
+        self.frameStart = clock()
+
+    def endFrame(self):
+        if not self.enabled:
+            return
+        total = clock() - self.frameStart
+        self.history.append(total)
+        self.add('frame', total)
+        for (name, t) in self.times.items():
+            if name not in self.averages:
+                self.averages[name] = t
+            else:
+                self.averages[name] = self.averages[name] * 0.9 + t * 0.1
+        self.lastCounts = dict(self.counts)
+
+    def start(self, name):
+        if self.enabled:
+            if name not in self.order:
+                self.order.append(name)
+            self.starts[name] = clock()
+
+    def stop(self, name):
+        if self.enabled:
+            self.add(name, clock() - self.starts[name])
+
+    def add(self, name, seconds):
+        # sections are listed in the order they were first started
+        if name not in self.order:
+            self.order.append(name)
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def paint(self, surface, font, x, y, budget):
+        # draw the smoothed section times, the counters and a graph of the
+        # recent frame times (scaled so the frame budget is half way up)
+        lines = ['{:<24}{:6.2f} ms'.format(name, self.averages[name] * 1000.0)
+                for name in self.order if name in self.averages]
+        lines += ['{:<24}{:6d}'.format(name, count)
+                for (name, count) in sorted(self.lastCounts.items())]
+
+        (graphwidth, graphheight) = (self.history.maxlen, 40)
+        height = len(lines) * font.get_linesize() + graphheight + 12
+        width = max([font.size(line)[0] for line in lines] + [graphwidth]) + 8
+        panel = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+        panel.fill((0, 0, 0, 160))
+
+        for (row, line) in enumerate(lines):
+            text = font.render(line, False, (255, 255, 255))
+            panel.blit(text, (4, 4 + row * font.get_linesize()))
+
+        # one bar per frame, red where it went over budget
+        bottom = height - 4
+        pygame.draw.line(panel, (80, 80, 80), (4, bottom - graphheight / 2),
+                (4 + graphwidth, bottom - graphheight / 2))
+        for (i, t) in enumerate(self.history):
+            bar = min(int(t / budget * graphheight / 2), graphheight)
+            color = (255, 64, 64) if t > budget else (64, 255, 64)
+            pygame.draw.line(panel, color, (4 + i, bottom), (4 + i, bottom - bar))
+
+        surface.blit(panel, (x, y))
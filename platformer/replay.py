@@ -0,0 +1,150 @@
+#
+# Recorded play.
+#
+# A Recording is the input the game logic saw on every frame, as a mask
+# with a bit for each key in KEYS that was held down and another for each
+# that was pressed that frame.  Most frames have the same mask as the one
+# before, so it is kept (and written) as runs of (frames, mask).  The file
+# also says which maps were played and how, and has a hash of the state of
+# the game at the end, so that playing it back can check that it ends up
+# in the same place.
+#
+# Playing a recording back runs a headless game as fast as it will go,
+# which makes it a repeatable workload for timing as well as a way to see
+# a bug happen again.
+#
+import hashlib
+import pygame
+import struct
+
+MAGIC = 'PREC'
+VERSION = 1
+
+# the keys the game logic looks at; the first is bit 0
+KEYS = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN,
+        pygame.K_SPACE, pygame.K_c)
+
+# the bits for the keys pressed that frame are this far up the mask
+NEWSHIFT = 8
+
+# magic, version, frames per second, streamed?, frames, state sha1,
+# number of maps; then each map name (length and bytes), then the runs
+HEADER = struct.Struct('<4sHHBI20sH')
+NAME = struct.Struct('<H')
+RUN = struct.Struct('<HH')
+MAXRUN = 0xffff
+
+class ReplayError(Exception):
+    def __init__(self, filename, problem):
+        Exception.__init__(self, '{}: {}'.format(filename, problem))
+        self.filename = filename
+        self.problem = problem
+
+def encode(keys, newkeys):
+    mask = 0
+    for (bit, key) in enumerate(KEYS):
+        if key in keys:
+            mask |= 1 << bit
+        if key in newkeys:
+            mask |= 1 << (bit + NEWSHIFT)
+    return mask
+
+# masks seen so far, and the (keys, newkeys) sets for each
+_decoded = {}
+
+def decode(mask):
+    sets = _decoded.get(mask)
+    if sets is None:
+        keys = frozenset(key for (bit, key) in enumerate(KEYS) if mask & (1 << bit))
+        newkeys = frozenset(key for (bit, key) in enumerate(KEYS)
+                if mask & (1 << (bit + NEWSHIFT)))
+        sets = _decoded[mask] = (keys, newkeys)
+    return sets
+
+class Recording:
+    def __init__(self, maplist, fps, stream):
+        self.maplist = list(maplist)
+        self.fps = fps
+        self.stream = stream
+        self.frames = 0
+        self.runs = []
+        self.digest = None
+
+    def record(self, keys, newkeys):
+        mask = encode(keys, newkeys)
+        if len(self.runs) > 0 and self.runs[-1][1] == mask and self.runs[-1][0] < MAXRUN:
+            self.runs[-1][0] += 1
+        else:
+            self.runs.append([1, mask])
+        self.frames += 1
+
+    def inputs(self):
+        # (keys, newkeys) for each frame in turn
+        for (count, mask) in self.runs:
+            sets = decode(mask)
+            for n in xrange(count):
+                yield sets
+
+def digest(game):
+    # a hash of the state of a Platformer: the level it is on, the score,
+    # and the camera and every sprite in the level
+    state = [game.number, game.coincount]
+    if game.world is not None:
+        state.append((game.world.x, game.world.y, game.p.coincount))
+        state.extend(sorted((sprite.name, sprite.x, sprite.y, sprite.dx, sprite.dy)
+                for sprite in game.world.sprites.itervalues()))
+    return hashlib.sha1(repr(state)).digest()
+
+def play(game, recording):
+    # feed the recorded input to a headless game, without waiting for the
+    # clock; returns whether it ends up where the recording did
+    for (keys, newkeys) in recording.inputs():
+        game.step(keys, newkeys)
+    return digest(game) == recording.digest
+
+def read(filename):
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except IOError as e:
+        raise ReplayError(filename, e.strerror)
+
+    if len(data) < HEADER.size:
+        raise ReplayError(filename, 'too short to be a recording')
+    (magic, version, fps, stream, frames, sha1, maps) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ReplayError(filename, 'not a recording')
+    if version != VERSION:
+        raise ReplayError(filename, 'recording version {}, expected {}'.format(version, VERSION))
+
+    offset = HEADER.size
+    maplist = []
+    for n in xrange(maps):
+        if offset + NAME.size > len(data):
+            raise ReplayError(filename, 'map list cut short')
+        (length,) = NAME.unpack_from(data, offset)
+        offset += NAME.size
+        maplist.append(data[offset:offset + length])
+        offset += length
+    if (len(data) - offset) % RUN.size != 0:
+        raise ReplayError(filename, 'runs cut short')
+
+    recording = Recording(maplist, fps, bool(stream))
+    for offset in xrange(offset, len(data), RUN.size):
+        recording.runs.append(list(RUN.unpack_from(data, offset)))
+    recording.frames = sum(count for (count, mask) in recording.runs)
+    if recording.frames != frames:
+        raise ReplayError(filename, 'has {} frames, expected {}'.format(recording.frames, frames))
+    recording.digest = sha1
+    return recording
+
+def write(filename, recording):
+    parts = [HEADER.pack(MAGIC, VERSION, recording.fps, int(recording.stream),
+            recording.frames, recording.digest, len(recording.maplist))]
+    for name in recording.maplist:
+        parts.append(NAME.pack(len(name)))
+        parts.append(name)
+    for (count, mask) in recording.runs:
+        parts.append(RUN.pack(count, mask))
+    with open(filename, 'wb') as f:
+        f.write(''.join(parts))
@@ -0,0 +1,83 @@
+import numpy
+
+# directions to look in, as indexes into SolidMap.runs
+LEFT = 0
+RIGHT = 1
+UP = 2
+DOWN = 3
+STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+# runs longer than this are stored as MAXRUN (see SolidMap.freeRun)
+MAXRUN = 255
+
+def _runs(solid):
+    # for each tile, how many free tiles there are to its right before the
+    # next solid one or the edge of the map
+    (height, width) = solid.shape
+    runs = numpy.zeros((height, width), dtype=numpy.uint8)
+    for x in xrange(width - 2, -1, -1):
+        runs[:, x] = numpy.where(solid[:, x + 1], 0,
+                numpy.minimum(runs[:, x + 1], MAXRUN - 1) + 1)
+    return runs
+
+class SolidMap:
+    # Which tiles of a map are solid, packed eight to a byte, along with the
+    # number of free tiles between each tile and the next solid tile (or
+    # the edge of the map) in each of the four directions, so that "how far
+    # can I go from here" does not need a search.
+    def __init__(self, width, height, bits, runs):
+        self.width = width
+        self.height = height
+        self.bits = bits
+        self.runs = runs
+
+    def tostring(self):
+        return ''.join([self.bits.tostring()] + [runs.tostring() for runs in self.runs])
+
+    def toArray(self):
+        # back to a 2D array of bools
+        return numpy.unpackbits(self.bits, axis=1)[:, :self.width].astype(numpy.bool_)
+
+    def isSolid(self, x, y):
+        return (self.bits.item(y, x >> 3) >> (7 - (x & 7))) & 1 == 1
+
+    def freeRun(self, x, y, direction):
+        # how many free tiles there are beyond (x, y) in direction before
+        # the next solid tile or the edge of the map; long runs are stored
+        # as MAXRUN, in which case we carry on from the end of it
+        runs = self.runs[direction]
+        (stepx, stepy) = STEPS[direction]
+        total = 0
+        while True:
+            run = runs.item(y, x)
+            total += run
+            if run < MAXRUN:
+                return total
+            (x, y) = (x + stepx * run, y + stepy * run)
+
+def fromArray(solid):
+    # from a 2D array of bools, indexed [y][x]
+    solid = numpy.asarray(solid, dtype=numpy.bool_)
+    (height, width) = solid.shape
+    runs = [numpy.ascontiguousarray(_runs(solid[:, ::-1])[:, ::-1]),
+            _runs(solid),
+            numpy.ascontiguousarray(_runs(solid.T[:, ::-1])[:, ::-1].T),
+            numpy.ascontiguousarray(_runs(solid.T).T)]
+    return SolidMap(width, height, numpy.packbits(solid, axis=1), runs)
+
+def stringLength(width, height):
+    # how many bytes tostring gives for a map this size
+    return height * ((width + 7) // 8) + 4 * width * height
+
+def frombuffer(data, offset, width, height):
+    # a SolidMap whose arrays point into data, as written by tostring
+    rowbytes = (width + 7) // 8
+    bits = numpy.frombuffer(data, dtype=numpy.uint8,
+            count=height * rowbytes, offset=offset).reshape(height, rowbytes)
+    offset += height * rowbytes
+    runs = []
+    for direction in (LEFT, RIGHT, UP, DOWN):
+        runs.append(numpy.frombuffer(data, dtype=numpy.uint8,
+                count=width * height, offset=offset).reshape(height, width))
+        offset += width * height
+    return SolidMap(width, height, bits, runs)
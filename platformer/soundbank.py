@@ -0,0 +1,73 @@
+import pygame
+import sys
+
+# how many sounds can play at once
+CHANNELS = 8
+
+# an effect is not started again until this many milliseconds after it
+# last was, so a pile of coins picked up together makes one sound
+INTERVAL = 60
+
+class SoundBank:
+    # Sound effects, each decoded once and then shared by everything that
+    # plays it, played on a fixed set of mixer channels.  When they are all
+    # busy the one that has been playing longest is cut off to make room.
+    def __init__(self, channels=CHANNELS, interval=INTERVAL):
+        self.interval = interval
+        self.sounds = {}
+        self.started = {}
+        self.channels = []
+        self.playing = []
+        if pygame.mixer.get_init() is None:
+            # no sound card (or a headless game): play() does nothing
+            return
+        pygame.mixer.set_num_channels(channels)
+        for n in xrange(channels):
+            self.channels.append(pygame.mixer.Channel(n))
+            self.playing.append(0)
+
+    def load(self, filename):
+        # decode a sound, unless we already have; the sound is returned in
+        # case the caller wants it, but play() only needs the filename
+        sound = self.sounds.get(filename)
+        if sound is None and len(self.channels) > 0:
+            try:
+                sound = pygame.mixer.Sound(filename)
+            except pygame.error as e:
+                print >>sys.stderr, 'SoundBank: could not load {}: {}'.format(filename, e)
+                sys.exit(1)
+            self.sounds[filename] = sound
+        return sound
+
+    def play(self, filename):
+        if len(self.channels) == 0:
+            return
+        sound = self.sounds.get(filename)
+        if sound is None:
+            sound = self.load(filename)
+
+        # did this effect only just start?
+        now = pygame.time.get_ticks()
+        if now - self.started.get(filename, -self.interval) < self.interval:
+            return
+        self.started[filename] = now
+
+        # use a free channel, or else the one that started longest ago
+        oldest = 0
+        for n in xrange(len(self.channels)):
+            if not self.channels[n].get_busy():
+                oldest = n
+                break
+            if self.playing[n] < self.playing[oldest]:
+                oldest = n
+        self.playing[oldest] = now
+        self.channels[oldest].play(sound)
+
+# the one bank for the whole game, so sounds outlive the levels that use them
+_shared = None
+
+def shared():
+    global _shared
+    if _shared is None:
+        _shared = SoundBank()
+    return _shared
@@ -0,0 +1,103 @@
+# cells are keyed by cy * STRIDE + cx rather than by (cx, cy), so that
+# looking one up does not make a tuple
+STRIDE = 1 << 20
+
+class SpatialHash:
+    # sprites bucketed by the square cells (cellsize pixels on a side) that
+    # they overlap.  Only cells with something in them are stored, and a
+    # sprite's buckets are only touched when the set of cells it covers
+    # actually changes.
+    def __init__(self, cellsize):
+        self.cellsize = cellsize
+        self.cells = {}
+        self.spans = {}
+
+    def _span(self, sprite):
+        # range of cells (left, top, right, bottom) covered by a sprite
+        size = self.cellsize
+        (x, y) = (int(sprite.x), int(sprite.y))
+        return (x // size, y // size,
+                (x + sprite.width - 1) // size, (y + sprite.height - 1) // size)
+
+    def add(self, sprite):
+        self.update(sprite)
+
+    def update(self, sprite):
+        # most moves stay within the same cells, so check that before
+        # making a new span
+        old = self.spans.get(sprite.name)
+        if old is not None:
+            size = self.cellsize
+            (x, y) = (int(sprite.x), int(sprite.y))
+            if x // size == old[0] and y // size == old[1] and \
+               (x + sprite.width - 1) // size == old[2] and \
+               (y + sprite.height - 1) // size == old[3]:
+                return
+
+        span = self._span(sprite)
+        if old is not None:
+            self._unlink(sprite.name, old)
+
+        (left, top, right, bottom) = span
+        for cy in xrange(top, bottom + 1):
+            for cx in xrange(left, right + 1):
+                cell = self.cells.get(cy * STRIDE + cx)
+                if cell is None:
+                    cell = self.cells[cy * STRIDE + cx] = {}
+                cell[sprite.name] = sprite
+        self.spans[sprite.name] = span
+
+    def remove(self, sprite):
+        old = self.spans.pop(sprite.name, None)
+        if old is not None:
+            self._unlink(sprite.name, old)
+
+    def _unlink(self, name, span):
+        (left, top, right, bottom) = span
+        for cy in xrange(top, bottom + 1):
+            for cx in xrange(left, right + 1):
+                cell = self.cells[cy * STRIDE + cx]
+                del cell[name]
+                if len(cell) == 0:
+                    del self.cells[cy * STRIDE + cx]
+
+    def queryRect(self, left, top, right, bottom, found=None):
+        # all sprites in cells overlapping a rectangle of pixels (inclusive),
+        # as a dict of name -> sprite.  If found is given it is emptied and
+        # filled in instead of making a new dict.
+        size = self.cellsize
+        if found is None:
+            found = {}
+        else:
+            found.clear()
+        for cy in xrange(int(top) // size, int(bottom) // size + 1):
+            for cx in xrange(int(left) // size, int(right) // size + 1):
+                cell = self.cells.get(cy * STRIDE + cx)
+                if cell is not None:
+                    found.update(cell)
+        return found
+
+    def queryNear(self, sprite, margin=0, found=None):
+        # all other sprites in cells within margin pixels of a sprite
+        (x, y) = (sprite.x, sprite.y)
+        found = self.queryRect(x - margin, y - margin,
+                x + sprite.width - 1 + margin,
+                y + sprite.height - 1 + margin, found)
+        found.pop(sprite.name, None)
+        return found
+
+    def getState(self):
+        # a copy of the index, for World.getState
+        return (self._copyCells(self.cells), dict(self.spans))
+
+    def setState(self, state):
+        (cells, spans) = state
+        self.cells = self._copyCells(cells)
+        self.spans = dict(spans)
+
+    def _copyCells(self, cells):
+        # keys() and values() come out in the same order
+        return dict(zip(cells.keys(), map(dict, cells.values())))
+
+    def __len__(self):
+        return len(self.spans)
@@ -1,6 +1,18 @@
 import math
+import pygame
+
+# kinds of force, as indexes into Sprite.totals
+CONSTANT = 0
+ONETIME = 1
+SLOWDOWN = 2
+KINDS = {'constant': CONSTANT, 'onetime': ONETIME, 'slowdown': SLOWDOWN}
+
+class Sprite(object):
+    # subclasses list their own attributes in __slots__ too, so that sprites
+    # do not each carry a dict around
+    __slots__ = ('world', 'kind', 'name', 'width', 'height', 'x', 'y', 'maxspeed',
+                 'dx', 'dy', 'forces', 'totals')
 
-class Sprite:
     def __init__(self, world, kind, name, width, height, x, y, maxspeed):
         self.world = world
         self.kind = kind
@@ -12,60 +24,74 @@ class Sprite:
         self.maxspeed = maxspeed
         self.dx = 0.0
         self.dy = 0.0
+
+        # the constant and slowdown forces by name, and the sum of each kind
+        # of force as [dx, dy] (indexed by CONSTANT, ONETIME and SLOWDOWN)
         self.forces = {}
+        self.totals = [[0.0, 0.0], [0.0, 0.0], [0.0, 0.0]]
 
     # add a new force acting on this sprite
     # kind is one of: 'constant', 'onetime', 'slowdown'
     #   * constant forces are applied every frame
-    #   * onetime forces are deleted after a single use
+    #   * onetime forces are deleted after a single use (onetime forces
+    #     added before the next move add up, whatever their names)
     #   * slowdown forces always push against the current direction,
     #     but never enough to change directions
+    # Each frame the constant and onetime forces are applied first, then
+    # the slowdown ones.
 
     def addForce(self, name, vector, kind):
+        kind = KINDS[kind]
+        total = self.totals[kind]
+        if kind == ONETIME:
+            total[0] += vector[0]
+            total[1] += vector[1]
+            return
+
+        self.removeForce(name)
         self.forces[name] = (kind, vector)
+        if kind == SLOWDOWN:
+            total[0] += abs(vector[0])
+            total[1] += abs(vector[1])
+        else:
+            total[0] += vector[0]
+            total[1] += vector[1]
 
     def removeForce(self, name):
         if name in self.forces:
-            del self.forces[name]
-
-    # get a list of points that make up the boundaries of this sprite
-    # for collision detection purposes
-    def getPoints(self):
-        return [ (self.x,              self.y),
-                 (self.x+self.width-1, self.y),
-                 (self.x,              self.y+self.height-1),
-                 (self.x+self.width-1, self.y+self.height-1) ]
-
-    def contains(self, point):
-        (x, y) = point
-        return x >= self.x and \
-               x < self.x+self.width and \
-               y >= self.y and \
-               y < self.y+self.height
+            (kind, (ddx, ddy)) = self.forces.pop(name)
+            total = self.totals[kind]
+            if kind == SLOWDOWN:
+                total[0] -= abs(ddx)
+                total[1] -= abs(ddy)
+            else:
+                total[0] -= ddx
+                total[1] -= ddy
+
+    # Everything about the sprite that changes as the game is played, for
+    # World.getState, and putting it back.  Subclasses add their own
+    # attributes to the tuple, as they do in __init__.
+    def getState(self):
+        return (self.x, self.y, self.dx, self.dy,
+                self.forces.copy(), [list(total) for total in self.totals])
+
+    def setState(self, state):
+        (self.x, self.y, self.dx, self.dy, forces, totals) = state
+        self.forces = forces.copy()
+        self.totals = [list(total) for total in totals]
 
     def move(self):
         if self.world is None:
             return
 
-        # remove ourself from the collision matrix
-        self.world.removeFromCollisionMatrix(self)
-
-        # apply forces
+        # apply forces, cancelling the one-time forces after using them
         (dx, dy) = (self.dx, self.dy)
-        for name in self.forces.keys():
-            kind, (ddx, ddy) = self.forces[name]
-
-            # cancel one-time forces after using them
-            if kind == 'onetime':
-                del self.forces[name]
-
-            # apply the force
-            if kind in ('constant', 'onetime'):
-                dx += ddx
-                dy += ddy
-            elif kind == 'slowdown':
-                dx -= math.copysign(min(abs(dx), abs(ddx)), self.dx)
-                dy -= math.copysign(min(abs(dy), abs(ddy)), self.dy)
+        (constant, onetime, slowdown) = self.totals
+        dx += constant[0] + onetime[0]
+        dy += constant[1] + onetime[1]
+        onetime[0] = onetime[1] = 0.0
+        dx -= math.copysign(min(abs(dx), slowdown[0]), self.dx)
+        dy -= math.copysign(min(abs(dy), slowdown[1]), self.dy)
 
         # clip velocity to maximum speed in each direction
         (maxdx, maxdy) = self.maxspeed
@@ -74,53 +100,137 @@ class Sprite:
         if abs(dy) > maxdy:
             dy = math.copysign(maxdy, dy)
 
-        # apply the motion one step at a time and check for collisions
+        self.sweep(dx, dy)
+
+    # move by (dx, dy) and make that our velocity, except along an axis
+    # where something stopped us
+    def sweep(self, dx, dy):
+        # sweep along each axis in turn, stopping at whatever stops us
         movex = int(round(dx))
         movey = int(round(dy))
-
-        while movex != 0 or movey != 0:
-            if movex != 0:
-                stepx = int(math.copysign(1, movex))
-                old = self.x
-                self.x += stepx
-                for (name, other) in self.world.findCollisions(self).items():
-                    stop = self.handleCollisionWith(name, other)
-                    if stop:
-                        # ran into something, so stop moving in x direction
-                        stepx = 0
-                        movex = 0
-                        dx = 0.0
-                        self.x = old
-                movex -= stepx
-            if movey != 0:
-                stepy = int(math.copysign(1, movey))
-                old = self.y
-                self.y += stepy
-                for (name, other) in self.world.findCollisions(self).items():
-                    stop = self.handleCollisionWith(name, other)
-                    if stop:
-                        # ran into something, so stop moving in y direction
-                        stepy = 0
-                        movey = 0
-                        dy = 0.0
-                        self.y = old
-                movey -= stepy
+        if movex != 0 and self.slide(0, movex):
+            dx = 0.0
+        if movey != 0 and self.slide(1, movey):
+            dy = 0.0
 
         (self.dx, self.dy) = (dx, dy)
 
-        # update our position in the collision matrix
-        self.world.addToCollisionMatrix(self)
+        # update our position in the world's spatial index
+        self.world.updateSprite(self)
+
+    # move distance pixels along one axis (0 for x, 1 for y), calling
+    # handleCollisionWith for each solid tile or map boundary we run into on
+    # the way.  Returns True if one of them stopped us, in which case we are
+    # left just short of it.  (Other sprites are dealt with once everything
+    # has moved, see World.handleContacts.)
+    def slide(self, axis, distance):
+        while distance != 0:
+            direction = int(math.copysign(1, distance))
+            start = self.x if axis == 0 else self.y
+            hit = self.world.castSprite(self, axis, distance)
+            if hit is None:
+                self._place(axis, start + distance)
+                return False
+
+            (step, name) = hit
+            self._place(axis, start + step * direction)
+            if self.handleCollisionWith(name, True):
+                self._place(axis, start + (step - 1) * direction)
+                return True
+
+            # we were allowed through it, so carry on from there
+            distance -= step * direction
+        return False
+
+    def _place(self, axis, position):
+        if axis == 0:
+            self.x = position
+        else:
+            self.y = position
+
+    # the tile this sprite looks like right now; the world compares it with
+    # last frame's to see which sprites need painting again
+    def getTile(self):
+        raise NotImplementedError()
+
+    # where this sprite is on the screen, in the paint the world is doing
+    # (between ticks, partway from where it was to where it is now)
+    def getScreenRect(self):
+        (x, y) = self.world.screenPosition(self)
+        return pygame.Rect(x, y, self.width, self.height)
 
     def paint(self, surface):
-        raise NotImplementedError()
+        self.paintTile(surface, self.getTile())
 
     def paintTile(self, surface, tile):
-        (offsetx, offsety) = (self.world.x, self.world.y)
-        surface.blit(tile, (self.x - offsetx, self.y - offsety))
+        surface.blit(tile, self.world.screenPosition(self))
+        self.world.profiler.count('blits')
 
     def game_logic(self, keys, newkeys):
         raise NotImplementedError()
 
+    # called for each wall we run into while moving (name is 'boundary' or
+    # 'solid' and other is True), and for each sprite we overlap once
+    # everything has moved; only walls can stop us
     def handleCollisionWith(self, name, other):
         # default behavior: stop when you run into something
         return name == 'boundary' or name == 'solid'
+
+class EntitySprite(Sprite):
+    # A sprite whose forces and speed limits live in its world's EntityStore
+    # rather than on the object itself, so that World.integrate can apply
+    # the forces on all of them at once before they move.  Its position and
+    # velocity are ordinary attributes, as they are read all the time while
+    # moving; integrate hands the velocities to the store and back.  As the
+    # velocity for a frame is worked out before game_logic is called, a
+    # onetime force added in game_logic only takes effect on the next frame.
+    __slots__ = ('store', 'slot')
+
+    def __init__(self, world, kind, name, width, height, x, y, maxspeed):
+        self.store = world.entities
+        self.slot = self.store.allocate()
+        # entities always keep their position as floats (see Magic.launch)
+        Sprite.__init__(self, world, kind, name, width, height, float(x), float(y), maxspeed)
+        (self.store.maxdx[self.slot], self.store.maxdy[self.slot]) = maxspeed
+
+    def addForce(self, name, vector, kind):
+        if kind == 'onetime':
+            self.store.onetimex[self.slot] += vector[0]
+            self.store.onetimey[self.slot] += vector[1]
+        else:
+            self._copyForces()
+            Sprite.addForce(self, name, vector, kind)
+            self._storeForces()
+
+    def removeForce(self, name):
+        if name in self.forces:
+            self._copyForces()
+            Sprite.removeForce(self, name)
+            self._storeForces()
+
+    def _copyForces(self):
+        # the forces and totals are replaced rather than changed in place,
+        # so that snapshots can share them (see getState); they hardly ever
+        # change after the sprite is made
+        self.forces = self.forces.copy()
+        self.totals = [list(total) for total in self.totals]
+
+    def _storeForces(self):
+        # copy the sums of the constant and slowdown forces to the store
+        (constant, onetime, slowdown) = self.totals
+        (self.store.constantx[self.slot], self.store.constanty[self.slot]) = constant
+        (self.store.slowdownx[self.slot], self.store.slowdowny[self.slot]) = slowdown
+
+    def getState(self):
+        # the pending onetime forces are saved with the EntityStore
+        return (self.x, self.y, self.dx, self.dy, self.forces, self.totals)
+
+    def setState(self, state):
+        (self.x, self.y, self.dx, self.dy, self.forces, self.totals) = state
+
+    def move(self):
+        if self.world is None:
+            return
+
+        # the forces were already applied by EntityStore.integrate
+        self.sweep(self.dx, self.dy)
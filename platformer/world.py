@@ -1,167 +1,598 @@
+import chunkcache
+import collections
+import entitystore
 import mapfile
+import operator
+from profiler import Profiler
 import pygame
+import solidmap
+import spatialhash
+from sprite import EntitySprite
+import timeit
+
+# sort keys for findContacts and paint
+_left = operator.attrgetter('x')
+_name = operator.attrgetter('name')
 
 class World:
-    def __init__(self, data):
+    def __init__(self, data, cellsize=64, profiler=None):
         self.data = data
         self.x = 0
         self.y = 0
         self.sprites = {}
 
-        # set up the collision matrix
-        self.matrix = []
-        (sizex, sizey) = (self.data.width, self.data.height)
-        for yy in range(sizey):
-            row = []
-            for xx in range(sizex):
-                row.append({})
-            self.matrix.append(row)
+        # where to report timings and counts (see Profiler)
+        if profiler is None:
+            profiler = Profiler()
+        self.profiler = profiler
+
+        # pre-rendered chunks of the static layers (set usechunks to False
+        # to draw them one tile at a time instead)
+        self.usechunks = True
+        bg = pygame.Color(self.data.backgroundcolor)
+        self.background = chunkcache.ChunkCache(data, data.background, bg)
+        if len(data.foreground) > 0:
+            self.foreground = chunkcache.ChunkCache(data, data.foreground)
+        else:
+            self.foreground = None
+
+        # index of which sprites are where, for collisions and painting
+        self.spatial = spatialhash.SpatialHash(cellsize)
+
+        # positions, velocities and forces of the EntitySprites
+        self.entities = entitystore.EntityStore()
+
+        # reused by awakeSprites, integrate and findContacts rather than
+        # making new ones on every call
+        self.awake = []
+        self.integrating = []
+        self.order = []
+        self.pairs = []
+
+        # what was on the screen after the last paint: the camera and the
+        # (tile, screen rect) of each visible sprite.  While the camera stays
+        # put only the places where these change are painted again (set
+        # usedirty to False to always paint the whole screen).
+        self.usedirty = True
+        self.camera = None
+        self.looks = None
+
+        # Where the camera was at the start of the last tick, and the
+        # sprites within paintmargin pixels of the view, so that paint can
+        # draw them partway between there and where they are now when the
+        # screen is painted more often than the game logic runs.  paintx
+        # and painty are where the camera is for the paint in progress, and
+        # alpha how far it is from the last tick to this one.
+        self.lastcamera = None
+        self.previous = {}
+        self.nearby = {}
+        self.paintmargin = 32
+        self.paintx = 0
+        self.painty = 0
+        self.alpha = 1.0
+
+        # Only sprites near the view are simulated: those within activemargin
+        # pixels of it every frame, those within sleepmargin pixels every
+        # sleeprate frames, and the rest not at all until the view comes
+        # back their way.  Until setView is called everything is simulated.
+        self.viewwidth = None
+        self.viewheight = None
+        self.activemargin = 160
+        self.sleepmargin = 640
+        self.sleeprate = 4
+        self.ticks = 0
+
+        # Streamed maps (see MapFile) only have the chunks near the view in
+        # memory, those within sleepmargin of it.  The objects in a chunk
+        # are handed to spawn to be made into sprites the first time it
+        # comes near, and once it has been out of range for a while its
+        # sprites are parked (taken out of the world, but kept) until it
+        # comes back.
+        self.spawn = None
+        self.live = collections.OrderedDict()
+        self.parked = {}
+        self.streamrange = None
 
     def addSprite(self, sprite):
         
         if sprite.name not in self.sprites:
             self.sprites[sprite.name] = sprite
-            self.addToCollisionMatrix(sprite)
+            self.spatial.add(sprite)
 
     def removeSprite(self, sprite):
         
         if sprite.name in self.sprites:
             del self.sprites[sprite.name]
-            self.removeFromCollisionMatrix(sprite)
-
-    def addToCollisionMatrix(self, sprite):
-       
-        if sprite.name not in self.sprites:
-            return
-        (tilesizex, tilesizey) = (self.data.tilewidth, self.data.tileheight)
-        (sizex, sizey) = (self.data.width, self.data.height)
-        for (x, y) in sprite.getPoints():
-            xx, yy = int(x) / tilesizex, int(y) / tilesizey
-            if xx < 0 or xx >= sizex or yy < 0 or yy >= sizey:
-                continue
-            self.matrix[yy][xx][sprite.name] = sprite
+            self.spatial.remove(sprite)
 
-    def removeFromCollisionMatrix(self, sprite):
-        
-        (sizex, sizey) = (self.data.width, self.data.height)
-        (tilesizex, tilesizey) = (self.data.tilewidth, self.data.tileheight)
-        for (x, y) in sprite.getPoints():
-            xx, yy = int(x) / tilesizex, int(y) / tilesizey
-            if xx < 0 or xx >= sizex or yy < 0 or yy >= sizey:
-                continue
-            if sprite.name in self.matrix[yy][xx]:
-                del self.matrix[yy][xx][sprite.name]
-
-    def findCollisions(self, sprite):
-        
-        (sizex, sizey) = (self.data.width, self.data.height)
-        (tilesizex, tilesizey) = (self.data.tilewidth, self.data.tileheight)
-        collisions = {}
-        candidates = {}
+    def updateSprite(self, sprite):
+        # a sprite moved, so update its position in the spatial index
+        if sprite.name in self.sprites:
+            self.spatial.update(sprite)
+
+    def findSprites(self, left, top, right, bottom, found=None):
+        # sprites that might overlap a rectangle of pixels (inclusive)
+        return self.spatial.queryRect(left, top, right, bottom, found)
+
+    def findNearbySprites(self, sprite, margin=0, found=None):
+        # other sprites that might be within margin pixels of a sprite
+        return self.spatial.queryNear(sprite, margin, found)
+
+    def setView(self, width, height):
+        # the size of the screen the world is seen through
+        self.viewwidth = width
+        self.viewheight = height
+
+    def castSprite(self, sprite, axis, distance):
+        # find the first solid tile or map boundary sprite would run into if
+        # it moved distance pixels along one axis (0 for x, 1 for y).
+        # Returns (step, 'solid' or 'boundary') with the step (1 ..
+        # abs(distance)) at which it would hit it, or None if the way is
+        # clear.  Other sprites are left to findContacts.
+        self.profiler.count('castSprite')
+        if axis == 0:
+            (pos, size) = (int(sprite.x), sprite.width)
+            (across, acrosssize) = (int(sprite.y), sprite.height)
+            (tilesize, acrosstilesize) = (self.data.tilewidth, self.data.tileheight)
+            (extent, acrossextent) = (self.data.width, self.data.height)
+        else:
+            (pos, size) = (int(sprite.y), sprite.height)
+            (across, acrosssize) = (int(sprite.x), sprite.width)
+            (tilesize, acrosstilesize) = (self.data.tileheight, self.data.tilewidth)
+            (extent, acrossextent) = (self.data.height, self.data.width)
+        steps = abs(distance)
+
+        # rows (or columns) of tiles we are sliding along
+        first = across // acrosstilesize
+        last = (across + acrosssize - 1) // acrosstilesize
+
+        # when do we leave the map?
+        wallname = 'boundary'
+        if first < 0 or last >= acrossextent:
+            wall = 1
+        elif distance > 0:
+            wall = max(extent * tilesize - (pos + size - 1), 1)
+        else:
+            wall = max(pos + 1, 1)
+
+        # find the first solid tile between here and there
+        if wall > 1:
+            if distance > 0:
+                lead = pos + size - 1
+                hit = self._findSolid(axis, max((pos + 1) // tilesize, 0), 1, first, last)
+                if hit is not None:
+                    step = max(hit * tilesize - lead, 1)
+                    if step < wall:
+                        (wall, wallname) = (step, 'solid')
+            else:
+                hit = self._findSolid(axis, min((pos + size - 2) // tilesize, extent - 1), -1,
+                        first, last)
+                if hit is not None:
+                    step = max(pos - (hit * tilesize + tilesize - 1), 1)
+                    if step < wall:
+                        (wall, wallname) = (step, 'solid')
+
+        if wall > steps:
+            return None
+        return (wall, wallname)
 
-        # collect all of the nearby sprites
-        for (x, y) in sprite.getPoints():
-            xx, yy = int(x) / tilesizex, int(y) / tilesizey
+    def game_logic(self, keys, newkeys):
+        if self.profiler.enabled:
+            self._profiledGameLogic(keys, newkeys)
+            return
 
-            # off the edge?
-            if xx < 0 or xx >= sizex or yy < 0 or yy >= sizey:
-                collisions['boundary'] = True
+        # pass the heartbeat along to all the sprites that are awake
+        self.rememberPositions()
+        self.streamChunks()
+        sprites = self.awakeSprites()
+        self.integrate(sprites)
+        for sprite in sprites:
+            sprite.game_logic(keys, newkeys)
+        self.handleContacts(sprites)
+
+    def _findSolid(self, axis, start, direction, first, last):
+        # the nearest solid tile, counting along axis from tile start in
+        # direction (1 or -1), in any of the rows (or columns) first to last
+        # across it; None if there are none before the edge of the map
+        solid = self.data.solid
+        if axis == 0:
+            extent = solid.width
+            run = solidmap.RIGHT if direction > 0 else solidmap.LEFT
+        else:
+            extent = solid.height
+            run = solidmap.DOWN if direction > 0 else solidmap.UP
+        if start < 0 or start >= extent:
+            return None
+
+        nearest = None
+        for across in xrange(first, last + 1):
+            (x, y) = (start, across) if axis == 0 else (across, start)
+            if solid.isSolid(x, y):
+                return start
+            hit = start + direction * (solid.freeRun(x, y, run) + 1)
+            if hit < 0 or hit >= extent:
                 continue
-
-            if self.data.solid[yy][xx]:
-                collisions['solid'] = True
-
-            for (name, other) in self.matrix[yy][xx].items():
-                # sprites do not collide with themselves
-                if other == sprite:
-                    continue
-
-                # add to the list of sprites to check against
-                candidates[name] = other
-
-        # now check for actual collisions with other nearby sprites
-        for point in sprite.getPoints():
-            added = []
-            for (name, other) in candidates.items():
-                if other.contains(point):
-                    collisions[name] = other
-                    added.append(name)
-
-            for elt in added:
-                del candidates[elt]
-
-        for (name, other) in candidates.items():
-            for point in other.getPoints():
-                if sprite.contains(point):
-                    collisions[name] = other
-
-        return collisions
-
-    def game_logic(self, keys, newkeys):
-        # pass the heartbeat along to all the sprites
-        for sprite in self.sprites.values():
+            if nearest is None or (hit - nearest) * direction < 0:
+                nearest = hit
+        return nearest
+
+    def findContacts(self, sprites):
+        # the pairs of sprites (still in the world) whose rectangles overlap,
+        # each pair once, found by sorting the sprites by their left edge and
+        # only comparing each one with those that start before it ends.  The
+        # same list is returned every time.
+        order = self.order
+        del order[:]
+        for sprite in sprites:
+            if sprite.name in self.sprites:
+                order.append(sprite)
+        order.sort(key=_left)
+
+        pairs = self.pairs
+        del pairs[:]
+        count = len(order)
+        for i in xrange(count):
+            sprite = order[i]
+            (x, y) = (sprite.x, sprite.y)
+            (right, bottom) = (x + sprite.width, y + sprite.height)
+            for j in xrange(i + 1, count):
+                other = order[j]
+                if other.x >= right:
+                    break
+                othery = other.y
+                if othery < bottom and othery + other.height > y:
+                    pairs.append((sprite, other))
+
+        self.profiler.count('contacts', len(pairs))
+        return pairs
+
+    def handleContacts(self, sprites):
+        # tell both sprites of every overlapping pair about each other.
+        # Pairs where one of them has already left the world (eaten, say,
+        # by an earlier pair) are skipped.
+        for (sprite, other) in self.findContacts(sprites):
+            if sprite.name in self.sprites and other.name in self.sprites:
+                sprite.handleCollisionWith(other.name, other)
+                other.handleCollisionWith(sprite.name, sprite)
+
+    def integrate(self, sprites):
+        # apply the forces on all of the EntitySprites among sprites at
+        # once, handing their velocities to the store and back through its
+        # buffers
+        store = self.entities
+        (slots, dx, dy) = (store.slots, store.dx, store.dy)
+        entities = self.integrating
+        del entities[:]
+        n = 0
+        for sprite in sprites:
+            if isinstance(sprite, EntitySprite):
+                slots[n] = sprite.slot
+                dx[n] = sprite.dx
+                dy[n] = sprite.dy
+                entities.append(sprite)
+                n += 1
+        if n == 0:
+            return
+        store.integrate(n)
+        n = 0
+        for sprite in entities:
+            sprite.dx = dx[n]
+            sprite.dy = dy[n]
+            n += 1
+
+    def rememberPositions(self):
+        # (at the start of each tick) where things are before they move
+        self.lastcamera = (self.x, self.y)
+        previous = self.previous
+        previous.clear()
+        if self.viewwidth is None:
+            return
+        margin = self.paintmargin
+        nearby = self.findSprites(self.x - margin, self.y - margin,
+                self.x + self.viewwidth - 1 + margin, self.y + self.viewheight - 1 + margin,
+                self.nearby)
+        for (name, sprite) in nearby.iteritems():
+            previous[name] = (sprite.x, sprite.y)
+
+    def awakeSprites(self):
+        # the sprites to simulate this frame (see activemargin)
+        self.ticks += 1
+        if self.viewwidth is None:
+            return self.sprites.values()
+
+        # everything that might be close enough to do anything
+        (left, top) = (self.x, self.y)
+        (right, bottom) = (self.x + self.viewwidth - 1, self.y + self.viewheight - 1)
+        margin = self.sleepmargin
+        nearby = self.findSprites(left - margin, top - margin, right + margin, bottom + margin)
+
+        # sprites in the ring outside the active region take turns, so that
+        # only a few of them are woken each frame
+        margin = self.activemargin
+        (left, top, right, bottom) = (left - margin, top - margin, right + margin, bottom + margin)
+        awake = self.awake
+        del awake[:]
+        for (name, sprite) in nearby.iteritems():
+            (x, y) = (sprite.x, sprite.y)
+            if x + sprite.width > left and x <= right and \
+               y + sprite.height > top and y <= bottom:
+                awake.append(sprite)
+            elif (self.ticks + hash(name)) % self.sleeprate == 0:
+                awake.append(sprite)
+
+        self.profiler.count('awake', len(awake))
+        return awake
+
+    def streamChunks(self):
+        # bring the chunks of a streamed map near the view into the world,
+        # and park the sprites of those that have been out of range longest
+        chunks = self.data.chunks
+        if chunks is None:
+            return
+        chunkwidth = chunks.chunksize * self.data.tilewidth
+        chunkheight = chunks.chunksize * self.data.tileheight
+        (width, height) = (self.viewwidth or 0, self.viewheight or 0)
+        margin = self.sleepmargin
+        left = max(int(self.x - margin) // chunkwidth, 0)
+        top = max(int(self.y - margin) // chunkheight, 0)
+        right = min(int(self.x + width - 1 + margin) // chunkwidth, chunks.sizex - 1)
+        bottom = min(int(self.y + height - 1 + margin) // chunkheight, chunks.sizey - 1)
+
+        # nothing to do until the view crosses into another chunk
+        old = self.streamrange
+        if old is not None and old[0] == left and old[1] == top and \
+           old[2] == right and old[3] == bottom:
+            return
+        self.streamrange = (left, top, right, bottom)
+
+        live = self.live
+        for cy in xrange(top, bottom + 1):
+            for cx in xrange(left, right + 1):
+                key = cy * chunks.sizex + cx
+                if key in live:
+                    # most recently used goes last
+                    del live[key]
+                else:
+                    self._wakeChunk(key)
+                live[key] = True
+
+        # keep as many again out of range, so going back and forth over the
+        # edge of a chunk does not keep parking and waking its sprites
+        limit = 2 * (right - left + 1) * (bottom - top + 1)
+        while len(live) > limit:
+            (key, value) = live.popitem(last=False)
+            self._parkChunk(key)
+
+    def _wakeChunk(self, key):
+        parked = self.parked.pop(key, None)
+        if parked is not None:
+            for sprite in parked:
+                self.addSprite(sprite)
+        elif self.spawn is not None:
+            (cy, cx) = divmod(key, self.data.chunks.sizex)
+            for obj in self.data.chunkObjects(cx, cy):
+                self.spawn(obj)
+        self.profiler.count('chunks woken')
+
+    def _parkChunk(self, key):
+        # take out the sprites whose top-left corner is in the chunk
+        chunks = self.data.chunks
+        (cy, cx) = divmod(key, chunks.sizex)
+        (width, height) = (chunks.chunksize * self.data.tilewidth,
+                chunks.chunksize * self.data.tileheight)
+        (left, top) = (cx * width, cy * height)
+        parked = []
+        for sprite in self.findSprites(left, top, left + width - 1, top + height - 1).values():
+            if left <= sprite.x < left + width and top <= sprite.y < top + height:
+                parked.append(sprite)
+        for sprite in parked:
+            self.removeSprite(sprite)
+        self.parked[key] = parked
+
+    def _profiledGameLogic(self, keys, newkeys):
+        # the same, but timing each kind of sprite
+        clock = timeit.default_timer
+        self.profiler.start('World.game_logic')
+        self.rememberPositions()
+        self.streamChunks()
+        sprites = self.awakeSprites()
+        self.profiler.start('World.integrate')
+        self.integrate(sprites)
+        self.profiler.stop('World.integrate')
+        for sprite in sprites:
+            start = clock()
             sprite.game_logic(keys, newkeys)
+            self.profiler.add(sprite.kind + '.game_logic', clock() - start)
+        self.profiler.start('World.handleContacts')
+        self.handleContacts(sprites)
+        self.profiler.stop('World.handleContacts')
+        self.profiler.stop('World.game_logic')
+
+    def getState(self):
+        # Everything about the world that changes as the game is played:
+        # the camera, which sprites are in it and all about them (see
+        # Sprite.getState), the EntityStore and the spatial index, and for
+        # streamed maps which chunks are live and which sprites are parked.
+        # setState puts it all back, as often as you like.
+        parked = dict((key, list(sprites)) for (key, sprites) in self.parked.iteritems())
+        states = [(sprite, sprite.getState()) for sprite in self.sprites.itervalues()]
+        for sprites in parked.itervalues():
+            states.extend((sprite, sprite.getState()) for sprite in sprites)
+        return (self.x, self.y, self.ticks, dict(self.sprites), states,
+                self.entities.getState(), self.spatial.getState(),
+                collections.OrderedDict(self.live), parked, self.streamrange)
+
+    def setState(self, state):
+        (self.x, self.y, self.ticks, sprites, states, entities, spatial,
+                live, parked, self.streamrange) = state
+        self.sprites.clear()
+        self.sprites.update(sprites)
+        for (sprite, saved) in states:
+            sprite.setState(saved)
+        self.entities.setState(entities)
+        self.spatial.setState(spatial)
+        self.live = collections.OrderedDict(live)
+        self.parked = dict((key, list(sprites)) for (key, sprites) in parked.iteritems())
+        self.lastcamera = None
+        self.previous.clear()
+        self.invalidate()
+
+    def prepare(self):
+        # get the chunks of the static layers for the current view drawn,
+        # so that the first paint does not have to
+        if self.viewwidth is None or not self.usechunks:
+            return
+        for layer in (self.background, self.foreground):
+            if layer is not None:
+                layer.prepare(self.x, self.y, self.viewwidth, self.viewheight)
+
+    def invalidate(self):
+        # paint the whole screen next time
+        self.looks = None
+
+    def paint(self, surface, regions=(), alpha=1.0):
+        # Paint the view.  Returns None if the whole screen was painted, or
+        # else the list of screen rectangles that changed: those where a
+        # sprite moved, changed or came and went since the last call, plus
+        # any regions passed in.  The whole screen is painted whenever the
+        # camera has moved.  The camera and sprites are painted alpha of
+        # the way from where they were at the start of the last tick to
+        # where they are now (see screenPosition).
+        self.profiler.start('World.paint')
+
+        # where the camera is
+        (x, y) = (self.x, self.y)
+        if alpha < 1.0 and self.lastcamera is not None:
+            (lastx, lasty) = self.lastcamera
+            x = int(round(lastx + (x - lastx) * alpha))
+            y = int(round(lasty + (y - lasty) * alpha))
+        (self.paintx, self.painty) = (x, y)
+        self.alpha = alpha
+
+        # gather list of sprites that might be visible (those just outside
+        # the view might be partway in), and how they look.  They are
+        # painted in order of name, so the player is on top and the order
+        # does not depend on where they are in the spatial index.
+        (width, height) = surface.get_size()
+        margin = self.paintmargin
+        sprites = self.findSprites(x - margin, y - margin,
+                x + width - 1 + margin, y + height - 1 + margin).values()
+        sprites.sort(key=_name)
+        looks = {}
+        for sprite in sprites:
+            looks[sprite.name] = (sprite.getTile(), sprite.getScreenRect())
+
+        camera = (x, y, width, height)
+        if self.usedirty and self.looks is not None and camera == self.camera:
+            rects = self._changedRects(looks, regions, surface.get_rect())
+        else:
+            rects = None
+        self.camera = camera
+        self.looks = looks
+
+        if rects is None:
+            blits = self._paintRegion(surface, sprites, looks)
+        else:
+            blits = 0
+            for rect in rects:
+                surface.set_clip(rect)
+                blits += self._paintRegion(surface,
+                        [s for s in sprites if looks[s.name][1].colliderect(rect)], looks)
+            surface.set_clip(None)
+
+        self.profiler.count('blits', blits)
+        self.profiler.stop('World.paint')
+        return rects
+
+    def screenPosition(self, sprite):
+        # where to paint a sprite in the paint in progress.  Anything that
+        # moved further than it can in a tick was put there (a fireball
+        # being thrown, say), so is not painted on the way.
+        (x, y) = (sprite.x, sprite.y)
+        if self.alpha < 1.0:
+            last = self.previous.get(sprite.name)
+            if last is not None:
+                (lastx, lasty) = last
+                (maxdx, maxdy) = sprite.maxspeed
+                if abs(x - lastx) <= maxdx and abs(y - lasty) <= maxdy:
+                    x = int(round(lastx + (x - lastx) * self.alpha))
+                    y = int(round(lasty + (y - lasty) * self.alpha))
+        return (x - self.paintx, y - self.painty)
+
+    def _changedRects(self, looks, regions, screen):
+        # the rectangles to paint again, given how the sprites look now
+        rects = [pygame.Rect(region) for region in regions]
+        for (name, (tile, rect)) in looks.items():
+            old = self.looks.get(name)
+            if old is None:
+                rects.append(rect)
+            elif old != (tile, rect):
+                rects.append(rect.union(old[1]))
+        for (name, (tile, rect)) in self.looks.items():
+            if name not in looks:
+                rects.append(rect)
+
+        # nothing off the edges of the screen
+        rects = [rect.clip(screen) for rect in rects]
+        return [rect for rect in rects if rect.width > 0 and rect.height > 0]
+
+    def _paintRegion(self, surface, sprites, looks):
+        # paint the part of the view inside the surface's clip rectangle;
+        # returns the number of blits
 
-    def paint(self, surface):
-        
         # blank the screen
         bg = pygame.Color(self.data.backgroundcolor)
         surface.fill(bg)
 
+        # paint the background, then the sprites, then the foreground over them
+        if self.usechunks:
+            blits = self.background.paint(surface, self.paintx, self.painty)
+        else:
+            blits = self.paintTiles(surface, self.data.background)
+
+        for sprite in sprites:
+            sprite.paintTile(surface, looks[sprite.name][0])
+
+        if self.foreground is None:
+            pass
+        elif self.usechunks:
+            blits += self.foreground.paint(surface, self.paintx, self.painty)
+        else:
+            blits += self.paintTiles(surface, self.data.foreground)
+        return blits
+
+    def paintTiles(self, surface, layer):
+        # draw a layer one tile at a time (slow, see ChunkCache); returns
+        # the number of blits
+        blits = 0
+
         # size of a single tile
         (tilesizex, tilesizey) = (self.data.tilewidth, self.data.tileheight)
 
         # position (in tiles) on the map of the top-left corner
-        (corner_x, corner_y) = (self.x / tilesizex, self.y / tilesizey)
+        (corner_x, corner_y) = (self.paintx / tilesizex, self.painty / tilesizey)
 
         # how far off (in pixels) we are from an even tile boundary
-        (offset_x, offset_y) = (self.x % tilesizex, self.y % tilesizey)
+        (offset_x, offset_y) = (self.paintx % tilesizex, self.painty % tilesizey)
 
         # how big is the view
         viewsize_x = (surface.get_width() + tilesizex - 1) / tilesizex
         viewsize_y = (surface.get_height() + tilesizey - 1) / tilesizey
 
-        # gather list of sprites that might be visible
-        sprites = {}
-
-        for screen_y in range(viewsize_y + 1):
-            map_y = screen_y + corner_y
-            for screen_x in range(viewsize_x + 1):
-                map_x = screen_x + corner_x
-
-                # paint the background tile at this position
-                if map_x < 0 or map_x >= self.data.width or map_y < 0 or map_y >= self.data.height:
-                    continue
-
-                gid = self.data.background[map_y][map_x]
-                if gid > 0:
-                    tile = self.data.tiles[gid]
-                    surface.blit(tile,
-                            (screen_x * tilesizex - offset_x,
-                             screen_y * tilesizey - offset_y))
-
-                # make note of any sprites that overlap this position
-                sprites.update(self.matrix[map_y][map_x])
-
-        # now paint any visible sprites
-        for sprite in sprites.values():
-            sprite.paint(surface)
-
         for screen_y in range(viewsize_y + 1):
             map_y = screen_y + corner_y
             for screen_x in range(viewsize_x + 1):
                 map_x = screen_x + corner_x
 
-                # paint the background tile at this position
+                # paint the tile at this position
                 if map_x < 0 or map_x >= self.data.width or map_y < 0 or map_y >= self.data.height:
                     continue
 
-                gid = self.data.foreground[map_y][map_x]
+                gid = layer[map_y, map_x]
                 if gid > 0:
                     tile = self.data.tiles[gid]
                     surface.blit(tile,
                             (screen_x * tilesizex - offset_x,
                              screen_y * tilesizey - offset_y))
-
-                # make note of any sprites that overlap this position
-                sprites.update(self.matrix[map_y][map_x])
+                    blits += 1
+        return blits